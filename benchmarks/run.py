@@ -0,0 +1,241 @@
+"""
+Time and memory-profile each stage of VocabTranslator on synthetic Athena vocabularies.
+
+For every scale (number of concepts), a vocabulary and source files are generated with
+`cwmed.synthetic` and each stage is timed, then run again under tracemalloc for its
+peak memory. The results are written as JSON, keyed by the commit they were measured
+at, so two runs can be compared:
+
+    python benchmarks/run.py --scales 10000 100000 1000000
+    python benchmarks/run.py --scales 5000000 --workdir /data/cwmed-bench
+    python benchmarks/run.py --compare <workdir>/results/<old>.json <workdir>/results/<new>.json
+
+Generated files and results are kept in --workdir, outside the repository, and the
+generated files are reused by later runs with the same scale and seed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cwmed as cw  # noqa: E402
+from cwmed.synthetic import generate_source_file, generate_vocabulary  # noqa: E402
+
+# (source vocabulary, target vocabulary) pairs translated at every scale.
+PAIRS = [('ICD10CM', 'SNOMED'), ('NDC', 'RxNorm')]
+
+
+def _stages(vocab, output_dir, workers):
+    """
+    Return the (name, function) stages of a lazy VocabTranslator, in pipeline order.
+
+    map_source_to_target repeats the map_source_concept_id_to_target_concept_id merge,
+    as `_map_source_to_target` does; the file reads are memoized and not repeated.
+    build_index builds the VocabIndex once, so translate_file times only the translation.
+    translate_files writes the files of translate_file on `workers` processes.
+    """
+    output_filepath = os.path.join(output_dir, 'out.csv')
+    failed_filepath = os.path.join(output_dir, 'failed.csv')
+    return [
+        ('read_source_file', lambda: vocab.source_frame),
+        ('read_concept_file', lambda: vocab.concept_file),
+        ('map_source_to_source_concept_id',
+         lambda: vocab._stage('source_concepts')),
+        ('read_concept_relationship_file',
+         lambda: vocab._stage('concept_relationships')),
+        ('map_source_concept_id_to_target_concept_id',
+         vocab._map_source_concept_id_to_target_concept_id),
+        ('map_source_to_target', lambda: vocab.target_table),
+        ('save_source_to_target', lambda: vocab.save_source_to_target(output_filepath)),
+        ('save_source_to_target_failed_mappings',
+         lambda: vocab.save_source_to_target_failed_mappings(failed_filepath)),
+        ('build_index', vocab._vocab_index),
+        ('translate_file', lambda: vocab.translate_file(output_filepath, failed_filepath)),
+        ('translate_files', lambda: vocab.translate_files([vocab.source_filepath], [output_filepath],
+                                                          [failed_filepath], workers=workers)),
+    ]
+
+
+def _translator(data_dir, source_vocab_value, target_vocab_value, source_filepath, source_code_col):
+    return cw.VocabTranslator(source_filepath=source_filepath,
+                              source_code_col=source_code_col,
+                              concept_filepath=os.path.join(data_dir, 'CONCEPT.csv'),
+                              source_vocab_value=source_vocab_value,
+                              target_vocab_value=target_vocab_value,
+                              concept_relationship_filepath=os.path.join(data_dir, 'CONCEPT_RELATIONSHIP.csv'),
+                              lazy=True)
+
+
+def _run_stages(data_dir, pair, source_filepath, source_code_col, output_dir, memory, workers):
+    """
+    Run the stages of a fresh translator once, returning {stage: seconds or peak bytes}.
+    """
+    vocab = _translator(data_dir, *pair, source_filepath, source_code_col)
+    results = {}
+    for name, stage in _stages(vocab, output_dir, workers):
+        if memory:
+            tracemalloc.start()
+            stage()
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            stage()
+            results[name] = time.perf_counter() - start
+    return results
+
+
+def prepare_data(workdir, concepts, source_rows, seed):
+    """
+    Generate the vocabulary and source files of one scale, unless a previous run did.
+
+    Returns: the data directory, the number of relationships and
+             {source vocabulary: (source filepath, code column)}.
+    """
+    data_dir = os.path.join(workdir, f'concepts-{concepts}-seed-{seed}')
+    meta_filepath = os.path.join(data_dir, 'meta.json')
+    if not os.path.exists(meta_filepath):
+        _, concept_relationship_filepath = generate_vocabulary(data_dir, concepts=concepts, seed=seed)
+        with open(concept_relationship_filepath) as f:
+            relationships = sum(1 for _ in f) - 1
+        with open(meta_filepath, 'w') as f:
+            json.dump({'concepts': concepts, 'seed': seed, 'relationships': relationships}, f)
+    with open(meta_filepath) as f:
+        relationships = json.load(f)['relationships']
+
+    sources = {}
+    for source_vocab_value, _ in PAIRS:
+        source_filepath = os.path.join(data_dir, f'{source_vocab_value.lower()}-{source_rows}.csv')
+        source_code_col = source_vocab_value.lower()
+        if not os.path.exists(source_filepath):
+            generate_source_file(data_dir, source_filepath, source_vocab_value,
+                                 rows=source_rows, source_code_col=source_code_col, seed=seed)
+        sources[source_vocab_value] = (source_filepath, source_code_col)
+    return data_dir, relationships, sources
+
+
+def run(scales, workdir, source_rows=None, repeat=3, memory=True, seed=0, workers=None):
+    """
+    Benchmark every stage for every scale and vocabulary pair.
+
+    Args:
+        scales (list): Numbers of concepts of the generated vocabularies.
+        workdir (str): Directory for the generated files.
+        source_rows (int, optional): Rows per source file. Defaults to a tenth of the concepts.
+        repeat (int): Number of timed runs; the fastest is kept.
+        memory (bool): Also measure the peak memory of each stage with tracemalloc.
+        seed (int): Seed of the generated files.
+        workers (int, optional): Worker processes of translate_files. Defaults to the number of CPUs.
+
+    Returns: list of dicts with the scale, pair, stage, seconds and peak_bytes.
+    """
+    workers = workers or os.cpu_count() or 1
+    records = []
+    for concepts in scales:
+        rows = source_rows or max(1000, concepts // 10)
+        print(f"Preparing {concepts:,} concepts and {rows:,} source rows...")
+        data_dir, relationships, sources = prepare_data(workdir, concepts, rows, seed)
+
+        for pair in PAIRS:
+            source_filepath, source_code_col = sources[pair[0]]
+            with tempfile.TemporaryDirectory() as output_dir:
+                timings = [_run_stages(data_dir, pair, source_filepath, source_code_col,
+                                       output_dir, memory=False, workers=workers)
+                           for _ in range(repeat)]
+                peaks = (_run_stages(data_dir, pair, source_filepath, source_code_col,
+                                     output_dir, memory=True, workers=workers) if memory else {})
+            for stage in timings[0]:
+                seconds = min(timing[stage] for timing in timings)
+                records.append({'concepts': concepts,
+                                'relationships': relationships,
+                                'source_rows': rows,
+                                'source_vocab_value': pair[0],
+                                'target_vocab_value': pair[1],
+                                'stage': stage,
+                                'seconds': seconds,
+                                'peak_bytes': peaks.get(stage)})
+                peak = f"{peaks[stage] / 2 ** 20:10,.1f} MB" if memory else ''
+                print(f"{concepts:>10,} {pair[0]:>8} -> {pair[1]:<8} {stage:<45} {seconds:8.3f}s {peak}")
+    return records
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(baseline_filepath, current_filepath):
+    """
+    Print the ratio of the seconds and peak memory of each stage between two result files.
+
+    Returns: pd.DataFrame with one row per scale, pair and stage.
+    """
+    frames = []
+    for filepath in (baseline_filepath, current_filepath):
+        with open(filepath) as f:
+            frames.append(pd.DataFrame(json.load(f)['results']))
+    keys = ['concepts', 'source_vocab_value', 'target_vocab_value', 'stage']
+    df = frames[0].merge(frames[1], on=keys, suffixes=('_baseline', '_current'))
+    df['seconds_ratio'] = df['seconds_current'] / df['seconds_baseline']
+    df['memory_ratio'] = df['peak_bytes_current'] / df['peak_bytes_baseline'].replace(0, np.nan)
+    df = df[keys + ['seconds_baseline', 'seconds_current', 'seconds_ratio', 'memory_ratio']]
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df.to_string(index=False, float_format='{:.3f}'.format))
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='numbers of concepts to benchmark (an Athena release has about 5,000,000)')
+    parser.add_argument('--source-rows', type=int, help='rows per source file (default: concepts / 10)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the fastest is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help='worker processes of translate_files (default: CPUs)')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'cwmed-benchmarks'),
+                        help='directory for the generated files')
+    parser.add_argument('--output', help='result file (default: <workdir>/results/<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files instead of running the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit = _commit()
+    records = run(args.scales, args.workdir, source_rows=args.source_rows, repeat=args.repeat,
+                  memory=not args.no_memory, seed=args.seed, workers=args.workers)
+    output = args.output or os.path.join(args.workdir, 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    meta = {'commit': commit,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers or os.cpu_count() or 1,
+            'seed': args.seed,
+            'repeat': args.repeat}
+    with open(output, 'w') as f:
+        json.dump({'meta': meta, 'results': records}, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+"""
+Compiled on-disk cache of the Athena CONCEPT.csv and CONCEPT_RELATIONSHIP.csv files.
+
+Each file is compiled into a sibling directory (e.g. CONCEPT.csv.cwcache/) that holds
+one .npy array per column: integer ids are stored as int64, dates as integers and
+strings are dictionary encoded (integer codes plus a NUL separated UTF-8 blob of the
+unique values). The arrays are memory-mapped on load, so opening a cache only touches
+the pages of the columns and rows that are actually used.
+
+A cache is only used while it is fresh: the size and modification time of the source
+file must match the values recorded at compile time. When the cache was compiled with
+`content_hash=True`, a file whose modification time changed but whose size did not is
+re-hashed and the cache is kept if the SHA-256 still matches.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cwcache'
+
+# Column kinds: 'id' columns are parsed as strings and stored as int64, 'int' columns
+# are stored as numbers, every other column is a dictionary encoded string.
+CONCEPT_COLUMN_KINDS = {'concept_id': 'id',
+                        'valid_start_date': 'int',
+                        'valid_end_date': 'int'}
+CONCEPT_RELATIONSHIP_COLUMN_KINDS = {'concept_id_1': 'id',
+                                     'concept_id_2': 'id',
+                                     'valid_start_date': 'int',
+                                     'valid_end_date': 'int'}
+
+
+def cache_path(filepath):
+    """
+    Return the directory that holds the compiled cache of `filepath`.
+
+    Args:
+        filepath (str): Path to CONCEPT.csv or CONCEPT_RELATIONSHIP.csv.
+
+    Returns: str with the cache directory path.
+    """
+    return os.fspath(filepath) + CACHE_SUFFIX
+
+
+def compile_vocab(concept_filepath, concept_relationship_filepath,
+                  content_hash=False, chunksize=1000000):
+    """
+    Compile CONCEPT.csv and CONCEPT_RELATIONSHIP.csv into binary caches.
+
+    Once compiled, `VocabTranslator`, `get_unique_vocab` and the concept readers load the
+    vocabulary from the caches instead of parsing the tab-separated files.
+
+    Args:
+        concept_filepath (str): Path to CONCEPT.csv.
+        concept_relationship_filepath (str): Path to CONCEPT_RELATIONSHIP.csv.
+        content_hash (bool): Also record the SHA-256 of each file, so a cache survives a
+                             change of modification time when the content is unchanged.
+        chunksize (int): Number of rows parsed at a time while compiling.
+
+    Returns: tuple with the two cache directory paths.
+
+    Examples:
+    >>> import cwmed as cw
+    >>> cw.compile_vocab('/path/to/CONCEPT.csv', '/path/to/CONCEPT_RELATIONSHIP.csv')
+    ('/path/to/CONCEPT.csv.cwcache', '/path/to/CONCEPT_RELATIONSHIP.csv.cwcache')
+    """
+    concept_cache = compile_table(concept_filepath,
+                                  column_kinds=CONCEPT_COLUMN_KINDS,
+                                  converters={'concept_id': str, 'concept_code': str},
+                                  content_hash=content_hash,
+                                  chunksize=chunksize)
+    concept_relationship_cache = compile_table(concept_relationship_filepath,
+                                               column_kinds=CONCEPT_RELATIONSHIP_COLUMN_KINDS,
+                                               content_hash=content_hash,
+                                               chunksize=chunksize)
+    return concept_cache, concept_relationship_cache
+
+
+def compile_table(filepath, column_kinds=None, converters=None,
+                  content_hash=False, chunksize=1000000, destination=None):
+    """
+    Compile one tab-separated Athena file into a binary cache directory.
+
+    Args:
+        filepath (str): Path to the tab-separated file.
+        column_kinds (dict, optional): Maps column names to 'id' or 'int'.
+                                       Other columns are stored as strings.
+        converters (dict, optional): Converters passed to pd.read_csv, e.g. to keep
+                                     empty codes as '' rather than NaN.
+        content_hash (bool): Record the SHA-256 of the file.
+        chunksize (int): Number of rows parsed at a time.
+        destination (str, optional): Cache directory. Defaults to `cache_path(filepath)`.
+
+    Returns: str with the cache directory path.
+    """
+    column_kinds = column_kinds or {}
+    converters = converters or {}
+    destination = destination or cache_path(filepath)
+    stat = os.stat(filepath)
+
+    columns = list(pd.read_csv(filepath, sep='\t', nrows=0).columns)
+    encoders = [_ColumnEncoder(column, column_kinds.get(column, 'str'))
+                for column in columns]
+
+    reader = pd.read_csv(filepath, sep='\t', converters=converters,
+                         dtype={column: str for column in columns if column not in converters},
+                         chunksize=chunksize)
+    nrows = 0
+    for chunk in reader:
+        for encoder in encoders:
+            encoder.add(chunk[encoder.name])
+        nrows += len(chunk)
+
+    source = {'size': stat.st_size,
+              'mtime_ns': stat.st_mtime_ns,
+              'sha256': _sha256(filepath) if content_hash else None}
+    return _write_table(encoders, nrows, destination, source)
+
+
+def save_frame(df, destination, column_kinds=None):
+    """
+    Save a pd.DataFrame in the compiled cache format, to be opened with `open_table`.
+
+    Args:
+        df (pd.DataFrame): Table to save.
+        destination (str): Directory to write, replaced if it exists.
+        column_kinds (dict, optional): Maps column names to 'id' or 'int', like `compile_table`.
+
+    Returns: str with the directory path.
+    """
+    column_kinds = column_kinds or {}
+    encoders = [_ColumnEncoder(column, column_kinds.get(column, 'str')) for column in df.columns]
+    for encoder in encoders:
+        encoder.add(df[encoder.name])
+    return _write_table(encoders, len(df), destination, source=None)
+
+
+def _write_table(encoders, nrows, destination, source):
+    """
+    Write encoded columns and their meta.json to a temporary directory, then rename it to `destination`.
+    """
+    parent = os.path.dirname(os.path.abspath(destination))
+    tmp = tempfile.mkdtemp(prefix='.cwcache-', dir=parent)
+    try:
+        column_meta = []
+        for i, encoder in enumerate(encoders):
+            column_meta.append(encoder.save(tmp, f'c{i}'))
+        meta = {'version': CACHE_VERSION,
+                'source': source,
+                'nrows': nrows,
+                'columns': column_meta}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+        os.rename(tmp, destination)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    return destination
+
+
+def load_table(filepath):
+    """
+    Open the compiled cache of `filepath` if it exists and is fresh.
+
+    Args:
+        filepath (str): Path to the tab-separated file the cache was compiled from.
+
+    Returns: CompiledTable, or None when there is no usable cache.
+    """
+    directory = cache_path(filepath)
+    meta_path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION or not _is_fresh(filepath, meta['source']):
+        return None
+    return CompiledTable(directory, meta)
+
+
+def open_table(directory):
+    """
+    Open a table saved with `save_frame`, without a freshness check.
+
+    Args:
+        directory (str): Directory written by `save_frame`.
+
+    Returns: CompiledTable.
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION:
+        raise ValueError(f'{directory} was saved with another version of cwmed.')
+    return CompiledTable(directory, meta)
+
+
+class CompiledTable:
+    """
+    A compiled cache opened with memory-mapped column arrays.
+
+    Attributes:
+        directory (str): Cache directory.
+        nrows (int): Number of rows in the compiled file.
+        columns (list): Column names in file order.
+    """
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.nrows = meta['nrows']
+        self._meta = {column['name']: column for column in meta['columns']}
+        self.columns = [column['name'] for column in meta['columns']]
+        self._arrays = {}
+
+    def _load(self, filename):
+        if filename not in self._arrays:
+            path = os.path.join(self.directory, filename)
+            try:
+                self._arrays[filename] = np.load(path, mmap_mode='r')
+            except ValueError:
+                # Empty arrays cannot be memory-mapped.
+                self._arrays[filename] = np.load(path)
+        return self._arrays[filename]
+
+    def values(self, column):
+        """
+        Return the stored array of a column: int64 ids, numbers or dictionary codes.
+        """
+        return self._load(self._meta[column]['file'])
+
+    def dictionary(self, column, codes=None):
+        """
+        Decode the unique values of a dictionary encoded column.
+
+        Args:
+            column (str): Column name.
+            codes (np.ndarray, optional): Sorted unique codes to decode. All values are
+                                          decoded when None.
+
+        Returns: np.ndarray of str objects, aligned with `codes`.
+        """
+        meta = self._meta[column]
+        blob = self._load(meta['dictionary'])
+        offsets = self._load(meta['offsets'])
+        size = len(offsets) - 1
+        if codes is None or len(codes) > size // 8:
+            text = blob.tobytes().decode('utf-8')
+            values = np.array(text.split('\x00')[:-1] if size else [], dtype=object)
+            return values if codes is None else values[codes]
+        return np.array([blob[offsets[i]:offsets[i + 1] - 1].tobytes().decode('utf-8')
+                         for i in codes], dtype=object)
+
+    def isin(self, column, values, where=None):
+        """
+        Return a boolean mask of the rows whose `column` value is in `values`.
+
+        Args:
+            column (str): Column name.
+            values (array-like): Values to look for, as they appear in the file.
+            where (np.ndarray, optional): Boolean mask; rows outside it are not tested
+                                          and are False in the result.
+
+        Returns: np.ndarray of bool with one entry per row.
+        """
+        meta = self._meta[column]
+        stored = self.values(column)
+        rows = slice(None) if where is None else np.flatnonzero(where)
+        if meta['kind'] == 'str':
+            keep = pd.Index(values).unique()
+            uniques = self.dictionary(column)
+            wanted = np.append(pd.Index(uniques).isin(keep), False)
+            # Missing values have code -1, which indexes the trailing False.
+            hit = wanted[np.asarray(stored[rows], dtype=np.int64)]
+        else:
+            keep = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').dropna()
+            hit = pd.Series(np.asarray(stored[rows])).isin(keep.unique()).to_numpy()
+
+        if where is None:
+            return hit
+        mask = np.zeros(self.nrows, dtype=bool)
+        mask[rows] = hit
+        return mask
+
+    def column(self, column, rows=None, compact=False):
+        """
+        Decode one column the way pd.read_csv would have parsed it.
+
+        Args:
+            column (str): Column name.
+            rows (np.ndarray, optional): Row positions to decode. All rows when None.
+            compact (bool): Keep ids as int64 and return strings as a pd.Categorical
+                            of the values present in `rows`.
+
+        Returns: np.ndarray or pd.Categorical with the decoded values.
+        """
+        meta = self._meta[column]
+        stored = self.values(column)
+        stored = np.asarray(stored if rows is None else stored[rows])
+        if meta['kind'] == 'id':
+            return stored.copy() if compact else stored.astype(str).astype(object)
+        if meta['kind'] == 'int':
+            return stored.copy()
+
+        codes = stored.astype(np.int64)
+        needed, inverse = np.unique(codes, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        missing = bool(len(needed)) and needed[0] == -1
+        decoded = self.dictionary(column, needed[1:] if missing else needed)
+        if compact:
+            return pd.Categorical.from_codes(inverse - 1 if missing else inverse, decoded)
+        if missing:
+            decoded = np.concatenate([np.array([np.nan], dtype=object), decoded])
+        return decoded[inverse]
+
+    def unique(self, column):
+        """
+        Return the unique values of a dictionary encoded column in order of appearance,
+        like pd.Series.unique.
+        """
+        uniques = self.dictionary(column)
+        codes = self.values(column)
+        missing = np.flatnonzero(np.asarray(codes) == -1)
+        if len(missing):
+            before = np.asarray(codes[:missing[0]])
+            position = int(before.max()) + 1 if len(before) else 0
+            uniques = np.insert(uniques, position, np.nan)
+        return uniques
+
+    def to_frame(self, columns=None, mask=None, categorical=None):
+        """
+        Decode the cache into a pd.DataFrame.
+
+        Args:
+            columns (list, optional): Columns to decode. All columns when None.
+            mask (np.ndarray, optional): Boolean mask of the rows to decode. The index of
+                                         the result holds the original row positions.
+            categorical (list, optional): Decode these string columns as categoricals
+                                          and keep every id column as int64.
+
+        Returns: pd.DataFrame.
+        """
+        columns = self.columns if columns is None else list(columns)
+        rows = None if mask is None else np.flatnonzero(mask)
+        index = pd.RangeIndex(self.nrows) if rows is None else pd.Index(rows)
+        compact = categorical is not None
+        categorical = set(categorical or ())
+        data = {column: self.column(column, rows,
+                                    compact=compact and (column in categorical or
+                                                         self._meta[column]['kind'] == 'id'))
+                for column in columns}
+        return pd.DataFrame(data, index=index, columns=columns)
+
+
+class _ColumnEncoder:
+    """
+    Accumulate one column chunk by chunk in its compiled representation.
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.parts = []
+        self.index = {}
+        self.dictionary = []
+
+    def add(self, series):
+        if self.kind == 'id':
+            self.parts.append(pd.to_numeric(series, errors='raise').to_numpy(dtype=np.int64))
+        elif self.kind == 'int':
+            self.parts.append(pd.to_numeric(series, errors='raise').to_numpy())
+        else:
+            codes, uniques = pd.factorize(series)
+            mapping = np.array([self._code(value) for value in uniques], dtype=np.int64)
+            encoded = np.full(len(codes), -1, dtype=np.int64)
+            found = codes >= 0
+            encoded[found] = mapping[codes[found]]
+            self.parts.append(encoded)
+
+    def _code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            if '\x00' in value:
+                raise ValueError(f'Column {self.name} holds a NUL character and cannot be compiled.')
+            code = self.index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+
+    def save(self, directory, stem):
+        if self.parts:
+            values = np.concatenate(self.parts)
+        else:
+            values = np.array([], dtype=np.int64)
+        meta = {'name': self.name, 'kind': self.kind, 'file': f'{stem}.npy'}
+
+        if self.kind == 'str':
+            values = values.astype(_code_dtype(len(self.dictionary)))
+            encoded = [value.encode('utf-8') for value in self.dictionary]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) + 1 for value in encoded])
+            blob = np.frombuffer(b'\x00'.join(encoded) + (b'\x00' if encoded else b''),
+                                 dtype=np.uint8)
+            meta['dictionary'] = f'{stem}.dict.npy'
+            meta['offsets'] = f'{stem}.offsets.npy'
+            np.save(os.path.join(directory, meta['dictionary']), blob)
+            np.save(os.path.join(directory, meta['offsets']), offsets)
+
+        np.save(os.path.join(directory, meta['file']), values)
+        return meta
+
+
+def _code_dtype(size):
+    for dtype in (np.int8, np.int16, np.int32):
+        if size < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _sha256(filepath, blocksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_fresh(filepath, source):
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return False
+    if stat.st_size != source['size']:
+        return False
+    if stat.st_mtime_ns == source['mtime_ns']:
+        return True
+    return source.get('sha256') is not None and _sha256(filepath) == source['sha256']
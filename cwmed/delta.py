@@ -0,0 +1,152 @@
+"""
+Differences between two releases of an Athena vocabulary.
+
+A VocabDelta holds the concepts added, changed or removed between two releases and
+the "Maps to" relationships added or removed, including relationships that became
+invalid (see the `valid_on` argument of `VocabStore`). `VocabStore.apply_delta` applies
+it to a loaded or persisted store and `VocabTranslator.refresh` re-translates only the
+source codes whose mappings it can affect.
+"""
+import numpy as np
+import pandas as pd
+
+RELATIONSHIP_KEY = ['concept_id_1', 'concept_id_2']
+
+
+class VocabDelta:
+    """
+    Concepts and "Maps to" relationships that differ between two releases.
+
+    Attributes:
+        concepts (pd.DataFrame): Added and changed concepts, as in the new release.
+        old_concepts (pd.DataFrame): Changed and removed concepts, as in the old release.
+        added_relationships (pd.DataFrame): Relationships only in the new release.
+        removed_relationships (pd.DataFrame): Relationships only in the old release,
+                                              or no longer valid in the new one.
+
+    Examples:
+    >>> store = cw.VocabStore.load('store/')
+    >>> delta = store.diff('release/CONCEPT.csv', 'release/CONCEPT_RELATIONSHIP.csv')
+    >>> delta.summary()
+    {'added_concepts': 1204, 'changed_concepts': 310, 'removed_concepts': 0,
+     'added_relationships': 1391, 'removed_relationships': 87}
+    """
+
+    def __init__(self, concepts, old_concepts, added_relationships, removed_relationships):
+        self.concepts = concepts
+        self.old_concepts = old_concepts
+        self.added_relationships = added_relationships
+        self.removed_relationships = removed_relationships
+
+    @classmethod
+    def between(cls, old_concepts, old_relationships, new_concepts, new_relationships):
+        """
+        Compare two releases loaded with the same options (e.g. two `VocabStore` objects).
+
+        Concepts are matched on concept_id and compared on every column, so a change of
+        valid_end_date or invalid_reason is a change. Relationships are matched on
+        concept_id_1 and concept_id_2.
+
+        Args:
+            old_concepts (pd.DataFrame): Concepts of the old release.
+            old_relationships (pd.DataFrame): "Maps to" relationships of the old release.
+            new_concepts (pd.DataFrame): Concepts of the new release.
+            new_relationships (pd.DataFrame): "Maps to" relationships of the new release.
+
+        Returns: VocabDelta.
+        """
+        old_hashes = _row_hashes(old_concepts)
+        new_hashes = _row_hashes(new_concepts)
+        common = old_hashes.index.intersection(new_hashes.index)
+        changed = common[old_hashes[common].to_numpy() != new_hashes[common].to_numpy()]
+        added = new_hashes.index.difference(old_hashes.index)
+        removed = old_hashes.index.difference(new_hashes.index)
+
+        old_keys = pd.MultiIndex.from_frame(old_relationships[RELATIONSHIP_KEY])
+        new_keys = pd.MultiIndex.from_frame(new_relationships[RELATIONSHIP_KEY])
+
+        return cls(concepts=new_concepts[new_concepts['concept_id'].isin(added.union(changed))],
+                   old_concepts=old_concepts[old_concepts['concept_id'].isin(removed.union(changed))],
+                   added_relationships=new_relationships[~new_keys.isin(old_keys)],
+                   removed_relationships=old_relationships[~old_keys.isin(new_keys)])
+
+    def concept_ids(self):
+        """
+        Return the concept_id's whose concept or outgoing relationships changed.
+        """
+        return pd.Index(np.concatenate([
+            self.concepts['concept_id'].to_numpy(),
+            self.old_concepts['concept_id'].to_numpy(),
+            self.added_relationships['concept_id_1'].to_numpy(),
+            self.removed_relationships['concept_id_1'].to_numpy()])).unique()
+
+    def __len__(self):
+        return (len(self.concepts) + len(self.old_concepts) +
+                len(self.added_relationships) + len(self.removed_relationships))
+
+    def summary(self):
+        """
+        Count the changes.
+
+        Returns: dict with the number of added, changed and removed concepts and of
+                 added and removed relationships.
+        """
+        changed = int(self.concepts['concept_id'].isin(self.old_concepts['concept_id']).sum())
+        return {'added_concepts': len(self.concepts) - changed,
+                'changed_concepts': changed,
+                'removed_concepts': len(self.old_concepts) - changed,
+                'added_relationships': len(self.added_relationships),
+                'removed_relationships': len(self.removed_relationships)}
+
+    def affected_concept_ids(self, concept_relationships, max_hops=1):
+        """
+        Return the concept_id's whose translation the delta can change: the concepts
+        in `concept_ids` and those reaching them within `max_hops` "Maps to" relationships.
+
+        Args:
+            concept_relationships (pd.DataFrame): "Maps to" relationships of the new release.
+            max_hops (int): Maximum number of relationships followed by the translation.
+
+        Returns: pd.Index of concept_id's.
+        """
+        edges = pd.concat([concept_relationships[RELATIONSHIP_KEY],
+                           self.removed_relationships[RELATIONSHIP_KEY]], ignore_index=True)
+        affected = self.concept_ids()
+        for _ in range(max_hops):
+            sources = edges.loc[edges['concept_id_2'].isin(affected), 'concept_id_1']
+            reached = affected.union(pd.Index(sources.unique()))
+            if len(reached) == len(affected):
+                break
+            affected = reached
+        return affected
+
+
+def _row_hashes(concepts):
+    """
+    Hash each concept row, indexed by concept_id.
+
+    Rows are hashed as text, so a release parsed from the tab-separated file and one
+    loaded from a compiled cache (where an empty column may have another dtype) agree.
+    """
+    hashes = pd.util.hash_pandas_object(concepts.astype(str), index=False)
+    return pd.Series(hashes.to_numpy(), index=concepts['concept_id'].to_numpy())
+
+
+def diff_vocab(old_concept_filepath, old_concept_relationship_filepath,
+               new_concept_filepath, new_concept_relationship_filepath, **kwargs):
+    """
+    Compare two releases of CONCEPT.csv and CONCEPT_RELATIONSHIP.csv.
+
+    Args:
+        old_concept_filepath (str): Path to the old CONCEPT.csv.
+        old_concept_relationship_filepath (str): Path to the old CONCEPT_RELATIONSHIP.csv.
+        new_concept_filepath (str): Path to the new CONCEPT.csv.
+        new_concept_relationship_filepath (str): Path to the new CONCEPT_RELATIONSHIP.csv.
+        **kwargs: VocabStore arguments used to load both releases, e.g. vocabs or valid_on.
+
+    Returns: VocabDelta.
+    """
+    from cwmed import VocabStore
+
+    old = VocabStore(old_concept_filepath, old_concept_relationship_filepath, **kwargs)
+    return old.diff(new_concept_filepath, new_concept_relationship_filepath)
@@ -0,0 +1,563 @@
+"""
+Sorted, memory-mapped index for point lookups of concept codes.
+
+The index holds three groups of arrays:
+
+* concepts sorted by concept_code (stably, so concepts sharing a code keep their order
+  in CONCEPT.csv), with their concept_id, vocabulary and concept_name;
+* the concept_id's in sorted order with their position in the code order;
+* a CSR-style "Maps to" adjacency: sorted unique concept_id_1 values, an index pointer
+  and the concept_id_2 values in CONCEPT_RELATIONSHIP.csv order.
+
+Lookups are binary searches against these arrays. An index saved with `save` is opened
+with memory-mapped arrays, so only the pages touched by a lookup are read from disk.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cwmed.normalize import CodeMatcher
+from cwmed.readers import read_concept_file, read_concept_relationship_file
+
+INDEX_VERSION = 1
+
+_ARRAYS = ('code_keys', 'concept_ids', 'concept_vocabs', 'name_blob', 'name_offsets',
+           'id_keys', 'id_positions', 'maps_src', 'maps_indptr', 'maps_dst')
+
+
+class VocabIndex:
+    """
+    Index of CONCEPT.csv and the "Maps to" rows of CONCEPT_RELATIONSHIP.csv.
+
+    Build it once from the Athena files (or their compiled caches), `save` it to a
+    directory and `open` it wherever lookups are needed.
+
+    Attributes:
+        vocabularies (list): vocabulary_id values, in the order of their integer codes.
+
+    Examples:
+    >>> index = cw.VocabIndex.build('tests/data/input/icd10_to_snomed_concept.csv',
+                                    'tests/data/input/icd10_to_snomed_concept_relationship.csv')
+    >>> index.save('/path/to/index')
+    >>> index = cw.VocabIndex.open('/path/to/index')
+    >>> index.lookup('A04.4', 'ICD10CM', 'SNOMED')
+    [{'ICD10CM': 'A04.4', 'ICD10CM_label': 'Other intestinal Escherichia coli infections',
+      'ICD10CM_omop_id': '35205417', 'SNOMED': '111839008',
+      'SNOMED_label': 'Intestinal infection due to E. coli', 'SNOMED_omop_id': '192815'}]
+    """
+
+    def __init__(self, arrays, vocabularies, names=None):
+        self._arrays = arrays
+        self.vocabularies = list(vocabularies)
+        self._vocab_codes = {vocab: code for code, vocab in enumerate(self.vocabularies)}
+        self._names = names
+        self._matchers = {}
+
+    def __len__(self):
+        return len(self._arrays['concept_ids'])
+
+    @classmethod
+    def build(cls, concept_filepath, concept_relationship_filepath, chunksize=1000000):
+        """
+        Build an in-memory index from CONCEPT.csv and CONCEPT_RELATIONSHIP.csv.
+
+        The compiled caches are used when present (see `compile_vocab`).
+
+        Args:
+            concept_filepath (str): Path to CONCEPT.csv.
+            concept_relationship_filepath (str): Path to CONCEPT_RELATIONSHIP.csv.
+            chunksize (int): Number of rows parsed at a time from CONCEPT_RELATIONSHIP.csv.
+
+        Returns: VocabIndex.
+        """
+        concept_df = read_concept_file(concept_filepath,
+                                       columns=['concept_id', 'concept_name',
+                                                'vocabulary_id', 'concept_code'])
+        concept_relationship_df = read_concept_relationship_file(concept_relationship_filepath,
+                                                                 chunksize=chunksize)
+        return cls.from_frames(concept_df, concept_relationship_df)
+
+    @classmethod
+    def from_frames(cls, concept_df, concept_relationship_df):
+        """
+        Build an in-memory index from already loaded tables.
+
+        Args:
+            concept_df (pd.DataFrame): Concepts with concept_id, concept_code,
+                                       concept_name and vocabulary_id.
+            concept_relationship_df (pd.DataFrame): Relationships with concept_id_1 and
+                                                    concept_id_2. Only "Maps to" rows are
+                                                    used when relationship_id is present.
+
+        Returns: VocabIndex.
+        """
+        codes = _encode(concept_df['concept_code'].to_numpy(dtype=object))
+        order = np.argsort(codes, kind='stable')
+        concept_ids = _to_int64(concept_df['concept_id'])[order]
+        vocab_codes, vocabularies = pd.factorize(concept_df['vocabulary_id'])
+        names = concept_df['concept_name'].to_numpy(dtype=object)[order]
+
+        id_positions = np.argsort(concept_ids, kind='stable')
+
+        if 'relationship_id' in concept_relationship_df:
+            concept_relationship_df = concept_relationship_df[
+                concept_relationship_df['relationship_id'] == "Maps to"]
+        src = _to_int64(concept_relationship_df['concept_id_1'])
+        dst = _to_int64(concept_relationship_df['concept_id_2'])
+        edges = np.argsort(src, kind='stable')
+        maps_src, counts = np.unique(src[edges], return_counts=True)
+        maps_indptr = np.zeros(len(maps_src) + 1, dtype=np.int64)
+        np.cumsum(counts, out=maps_indptr[1:])
+
+        arrays = {'code_keys': codes[order],
+                  'concept_ids': concept_ids,
+                  'concept_vocabs': vocab_codes[order].astype(np.int16),
+                  'id_keys': concept_ids[id_positions],
+                  'id_positions': id_positions,
+                  'maps_src': maps_src,
+                  'maps_indptr': maps_indptr,
+                  'maps_dst': dst[edges]}
+        return cls(arrays, [str(vocab) for vocab in vocabularies], _Strings(values=names))
+
+    def save(self, directory):
+        """
+        Save the index to a directory of .npy arrays.
+
+        Args:
+            directory (str): Output directory, created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        blob, offsets = self._names.encoded()
+        arrays = dict(self._arrays, name_blob=blob, name_offsets=offsets)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), arrays[name])
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'vocabularies': self.vocabularies}, f)
+
+    @classmethod
+    def open(cls, directory):
+        """
+        Open a saved index with memory-mapped arrays.
+
+        Args:
+            directory (str): Directory written by `save`.
+
+        Returns: VocabIndex.
+        """
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f'{directory} holds an index of an unsupported version.')
+        arrays = {name: _load(os.path.join(directory, f'{name}.npy')) for name in _ARRAYS}
+        names = _Strings(blob=arrays.pop('name_blob'), offsets=arrays.pop('name_offsets'))
+        return cls(arrays, meta['vocabularies'], names)
+
+    def _vocab_mask(self, positions, vocabs):
+        wanted = np.zeros(len(self.vocabularies) + 1, dtype=bool)
+        for vocab in vocabs:
+            if vocab in self._vocab_codes:
+                wanted[self._vocab_codes[vocab]] = True
+        # Position -1 (no concept) indexes the trailing False.
+        vocab_codes = np.full(len(positions), -1, dtype=np.int64)
+        found = positions >= 0
+        vocab_codes[found] = self._arrays['concept_vocabs'][positions[found]]
+        return wanted[vocab_codes]
+
+    def matcher(self, vocab):
+        """
+        Return the CodeMatcher of a vocabulary's concept codes, built on first use.
+
+        Args:
+            vocab (str): vocabulary_id value.
+
+        Returns: CodeMatcher.
+        """
+        if vocab not in self._matchers:
+            vocab_code = self._vocab_codes.get(vocab, -1)
+            code_keys = self._arrays['code_keys']
+            in_vocab = np.asarray(self._arrays['concept_vocabs']) == vocab_code
+            self._matchers[vocab] = CodeMatcher(_decode(np.asarray(code_keys)[in_vocab]), vocab)
+        return self._matchers[vocab]
+
+    def match_codes(self, codes, vocabs):
+        """
+        Find the concepts of the given vocabularies whose concept_code is in `codes`.
+
+        Args:
+            codes (array-like): Concept codes.
+            vocabs (list): vocabulary_id values to search.
+
+        Returns: tuple of np.ndarray (rows, positions). Each code contributes one pair
+                 per matching concept, in CONCEPT.csv order, or a single pair with
+                 position -1 when nothing matches.
+        """
+        codes = np.asarray(codes, dtype=object)
+        inverse, uniques = pd.factorize(codes)
+        keys = _encode(uniques)
+        code_keys = self._arrays['code_keys']
+
+        fits = np.array([len(key) <= code_keys.itemsize for key in keys], dtype=bool)
+        lo = np.zeros(len(keys), dtype=np.int64)
+        hi = np.zeros(len(keys), dtype=np.int64)
+        if fits.any():
+            probe = keys[fits].astype(code_keys.dtype)
+            lo[fits] = np.searchsorted(code_keys, probe, side='left')
+            hi[fits] = np.searchsorted(code_keys, probe, side='right')
+
+        # Candidate concepts per unique code, then keep the requested vocabularies.
+        key_rows, positions = _expand(np.arange(len(keys)), lo, hi - lo, keep_empty=False)
+        keep = self._vocab_mask(positions, vocabs)
+        key_rows, positions = key_rows[keep], positions[keep]
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(key_rows, minlength=len(keys)), out=indptr[1:])
+
+        starts = np.where(inverse >= 0, indptr[inverse], 0)
+        counts = np.where(inverse >= 0, indptr[inverse + 1] - starts, 0)
+        rows, offsets = _expand(np.arange(len(codes)), starts, counts)
+        return rows, _take(positions, offsets)
+
+    def maps_to(self, concept_ids):
+        """
+        Follow the "Maps to" relationships of the given concept_id's.
+
+        Args:
+            concept_ids (np.ndarray): int64 concept_id's, -1 for missing.
+
+        Returns: tuple of np.ndarray (rows, target concept_id's). Each concept contributes
+                 one pair per relationship, in CONCEPT_RELATIONSHIP.csv order, or a single
+                 pair with target -1 when it has no relationship.
+        """
+        concept_ids = np.asarray(concept_ids, dtype=np.int64)
+        maps_src = self._arrays['maps_src']
+        indptr = self._arrays['maps_indptr']
+        starts = np.zeros(len(concept_ids), dtype=np.int64)
+        counts = np.zeros(len(concept_ids), dtype=np.int64)
+        if len(maps_src):
+            found = np.minimum(np.searchsorted(maps_src, concept_ids), len(maps_src) - 1)
+            hit = (np.asarray(maps_src[found]) == concept_ids) & (concept_ids >= 0)
+            starts[hit] = indptr[found[hit]]
+            counts[hit] = indptr[found[hit] + 1] - starts[hit]
+        rows, offsets = _expand(np.arange(len(concept_ids)), starts, counts)
+        return rows, _take(self._arrays['maps_dst'], offsets)
+
+    def follow(self, concept_ids, target_vocab, max_hops=1):
+        """
+        Follow "Maps to" relationships up to `max_hops` times until a concept of the target
+        vocabulary is reached.
+
+        All concepts are expanded together, one hop at a time: the frontier of every concept
+        is looked up in the CSR adjacency in one batch, (concept, reached concept) pairs that
+        were already visited are dropped, so cycles end, and a concept stops expanding at the
+        hop where it first reaches the target vocabulary. Concepts that reach no target
+        concept keep their direct relationships.
+
+        Args:
+            concept_ids (np.ndarray): int64 concept_id's, -1 for missing.
+            target_vocab (str): Value of the target vocabulary.
+            max_hops (int): Maximum number of relationships to follow.
+
+        Returns: tuple of np.ndarray (rows, target concept_id's), like `maps_to`.
+        """
+        concept_ids = np.asarray(concept_ids, dtype=np.int64)
+        rows, targets = self.maps_to(concept_ids)
+        if max_hops <= 1:
+            return rows, targets
+
+        n = len(concept_ids)
+        found_rows, found_targets = [], []
+        resolved = np.zeros(n, dtype=bool)
+        visited = pd.MultiIndex.from_arrays([np.arange(n), concept_ids])
+        frontier_rows, frontier_ids = rows, targets
+        for hop in range(1, max_hops + 1):
+            if hop > 1:
+                edges, next_ids = self.maps_to(frontier_ids)
+                frontier_rows, frontier_ids = frontier_rows[edges], next_ids
+
+            pairs = pd.DataFrame({'row': frontier_rows, 'concept_id': frontier_ids})
+            pairs = pairs[pairs['concept_id'] >= 0].drop_duplicates()
+            pairs = pairs[~pd.MultiIndex.from_frame(pairs).isin(visited)]
+            if pairs.empty:
+                break
+            visited = visited.append(pd.MultiIndex.from_frame(pairs))
+
+            pair_rows = pairs['row'].to_numpy()
+            pair_ids = pairs['concept_id'].to_numpy()
+            in_target = self.positions(pair_ids, [target_vocab]) >= 0
+            found_rows.append(pair_rows[in_target])
+            found_targets.append(pair_ids[in_target])
+            resolved[pair_rows[in_target]] = True
+
+            expand = ~in_target & ~resolved[pair_rows]
+            frontier_rows, frontier_ids = pair_rows[expand], pair_ids[expand]
+
+        # Rows that reached no target concept keep their direct relationships.
+        keep = ~resolved[rows]
+        rows = np.concatenate([rows[keep]] + found_rows)
+        targets = np.concatenate([targets[keep]] + found_targets)
+        order = np.argsort(rows, kind='stable')
+        return rows[order], targets[order]
+
+    def positions(self, concept_ids, vocabs=None):
+        """
+        Find the concepts with the given concept_id's.
+
+        Args:
+            concept_ids (np.ndarray): int64 concept_id's, -1 for missing.
+            vocabs (list, optional): Only return concepts of these vocabularies.
+
+        Returns: np.ndarray with the concept positions, -1 when not found.
+        """
+        concept_ids = np.asarray(concept_ids, dtype=np.int64)
+        id_keys = self._arrays['id_keys']
+        if not len(id_keys):
+            return np.full(len(concept_ids), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(id_keys, concept_ids), len(id_keys) - 1)
+        hit = (np.asarray(id_keys[found]) == concept_ids) & (concept_ids >= 0)
+        positions = np.where(hit, np.asarray(self._arrays['id_positions'][found]), -1)
+        if vocabs is not None:
+            positions = np.where(self._vocab_mask(positions, vocabs), positions, -1)
+        return positions
+
+    def codes(self, positions):
+        """
+        Return the concept_code of the concepts at `positions`, NaN for -1.
+        """
+        return _decode(_take(self._arrays['code_keys'], positions))
+
+    def names(self, positions):
+        """
+        Return the concept_name of the concepts at `positions`, NaN for -1.
+        """
+        return self._names.take(positions)
+
+    def ids(self, positions):
+        """
+        Return the concept_id of the concepts at `positions`, -1 when not found.
+        """
+        return _take(self._arrays['concept_ids'], positions)
+
+    def lookup_many(self, codes, source_vocab, target_vocab, max_hops=1, fallback=False):
+        """
+        Translate source codes to target codes.
+
+        Mirrors the table built by `VocabTranslator`: source codes are matched against
+        the concepts of both vocabularies, followed along "Maps to" and the target concept
+        is labelled when it belongs to one of the two vocabularies.
+
+        Args:
+            codes (array-like): Source codes.
+            source_vocab (str): Value of the source vocabulary.
+            target_vocab (str): Value of the target vocabulary.
+            max_hops (int): Maximum number of "Maps to" relationships to follow, see `follow`.
+            fallback (bool): Resolve codes that are not concept codes of the source vocabulary
+                             on their normalized form or their parent code first (see `matcher`)
+                             and add a `{source_vocab}_match_type` column.
+
+        Returns: pd.DataFrame with the source code, label and omop id
+                 and the target code, label and omop id.
+        """
+        codes = np.asarray(codes, dtype=object)
+        vocabs = [source_vocab, target_vocab]
+        matched = codes
+        if fallback:
+            matched, match_types = self.matcher(source_vocab).match(codes)
+        rows, source_positions = self.match_codes(matched, vocabs)
+        edges, target_ids = self.follow(self.ids(source_positions), target_vocab, max_hops)
+        rows, source_positions = rows[edges], source_positions[edges]
+        target_positions = self.positions(target_ids, vocabs)
+        # The source omop id comes from concept_id_1, so it is missing without a relationship.
+        source_ids = np.where(target_ids >= 0, self.ids(source_positions), -1)
+
+        df = pd.DataFrame({
+            source_vocab: codes[rows],
+            f'{source_vocab}_label': self.names(source_positions),
+            f'{source_vocab}_omop_id': _id_strings(source_ids),
+            target_vocab: self.codes(target_positions),
+            f'{target_vocab}_label': self.names(target_positions),
+            f'{target_vocab}_omop_id': _id_strings(target_ids),
+        })
+        if fallback:
+            df[f'{source_vocab}_match_type'] = match_types[rows]
+        return df
+
+    def lookup(self, code, source_vocab, target_vocab, max_hops=1):
+        """
+        Translate a single source code.
+
+        Args:
+            code (str): Source code.
+            source_vocab (str): Value of the source vocabulary.
+            target_vocab (str): Value of the target vocabulary.
+            max_hops (int): Maximum number of "Maps to" relationships to follow, see `follow`.
+
+        Returns: list of dicts, one per mapped target, with the same keys as the columns
+                 returned by `lookup_many`.
+        """
+        if max_hops > 1:
+            return self.lookup_many([code], source_vocab, target_vocab,
+                                    max_hops).to_dict('records')
+
+        arrays = self._arrays
+        vocabs = {self._vocab_codes[vocab] for vocab in (source_vocab, target_vocab)
+                  if vocab in self._vocab_codes}
+        positions = []
+        if isinstance(code, str):
+            key = code.encode('utf-8')
+            code_keys = arrays['code_keys']
+            if len(key) <= code_keys.itemsize:
+                lo = int(np.searchsorted(code_keys, key, side='left'))
+                hi = int(np.searchsorted(code_keys, key, side='right'))
+                positions = [p for p in range(lo, hi) if int(arrays['concept_vocabs'][p]) in vocabs]
+
+        records = []
+        for position in positions or [-1]:
+            source_id = int(arrays['concept_ids'][position]) if position >= 0 else -1
+            targets = self._maps_to_scalar(source_id)
+            for target_id in targets or [-1]:
+                target = self._position_scalar(target_id)
+                if target >= 0 and int(arrays['concept_vocabs'][target]) not in vocabs:
+                    target = -1
+                records.append({
+                    source_vocab: code,
+                    f'{source_vocab}_label': self.names([position])[0],
+                    f'{source_vocab}_omop_id': str(source_id) if targets else np.nan,
+                    target_vocab: self.codes([target])[0],
+                    f'{target_vocab}_label': self.names([target])[0],
+                    f'{target_vocab}_omop_id': str(target_id) if target_id >= 0 else np.nan,
+                })
+        return records
+
+    def _maps_to_scalar(self, concept_id):
+        maps_src = self._arrays['maps_src']
+        if concept_id < 0 or not len(maps_src):
+            return []
+        found = int(np.searchsorted(maps_src, concept_id))
+        if found == len(maps_src) or int(maps_src[found]) != concept_id:
+            return []
+        indptr = self._arrays['maps_indptr']
+        return [int(target) for target in self._arrays['maps_dst'][indptr[found]:indptr[found + 1]]]
+
+    def _position_scalar(self, concept_id):
+        id_keys = self._arrays['id_keys']
+        if concept_id < 0 or not len(id_keys):
+            return -1
+        found = int(np.searchsorted(id_keys, concept_id))
+        if found == len(id_keys) or int(id_keys[found]) != concept_id:
+            return -1
+        return int(self._arrays['id_positions'][found])
+
+
+# Never part of valid UTF-8, so it can stand for a missing string in the blob.
+_MISSING = b'\xff'
+
+
+class _Strings:
+    """
+    A column of strings held as an object array or as a NUL separated UTF-8 blob.
+    """
+
+    def __init__(self, values=None, blob=None, offsets=None):
+        self._values = values
+        self._blob = blob
+        self._offsets = offsets
+
+    def take(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        found = positions >= 0
+        out = np.full(len(positions), np.nan, dtype=object)
+        if self._values is not None:
+            out[found] = self._values[positions[found]]
+            return out
+        # Decode each distinct string once, gathering their bytes (with the NUL ending
+        # each of them) from the blob in one read rather than one slice per row.
+        uniques, inverse = np.unique(positions[found], return_inverse=True)
+        starts = np.asarray(self._offsets[uniques])
+        lengths = np.asarray(self._offsets[uniques + 1]) - starts
+        gather = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        gather += np.arange(len(gather), dtype=np.int64)
+        raw = np.asarray(self._blob[gather]).tobytes().split(b'\x00')[:-1]
+        decoded = np.array([np.nan if value == _MISSING else value.decode('utf-8')
+                            for value in raw], dtype=object)
+        out[found] = decoded[inverse.reshape(-1)]
+        return out
+
+    def encoded(self):
+        if self._values is None:
+            return self._blob, self._offsets
+        encoded = [value.encode('utf-8') if isinstance(value, str) else _MISSING
+                   for value in self._values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) + 1 for value in encoded])
+        blob = np.frombuffer(b'\x00'.join(encoded) + (b'\x00' if encoded else b''),
+                             dtype=np.uint8)
+        return blob, offsets
+
+
+def _expand(rows, starts, counts, keep_empty=True):
+    """
+    Repeat each row once per entry of its [start, start + count) range.
+
+    Returns: tuple (rows, offsets). With `keep_empty`, rows with no entries are
+             kept once with offset -1.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    repeats = np.maximum(counts, 1) if keep_empty else counts
+    out_rows = np.repeat(rows, repeats)
+    first = np.cumsum(repeats) - repeats
+    step = np.arange(len(out_rows), dtype=np.int64) - np.repeat(first, repeats)
+    offsets = np.repeat(starts, repeats) + step
+    if keep_empty:
+        offsets[np.repeat(counts == 0, repeats)] = -1
+    return out_rows, offsets
+
+
+def _take(array, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    found = positions >= 0
+    if array.dtype.kind == 'S':
+        out = np.zeros(len(positions), dtype=array.dtype)
+    else:
+        out = np.full(len(positions), -1, dtype=array.dtype)
+    out[found] = array[positions[found]]
+    if array.dtype.kind == 'S':
+        return np.where(found, out.astype(object), None)
+    return out
+
+
+def _encode(values):
+    """
+    Encode codes as a fixed-width bytes array. Missing codes become b''.
+    """
+    encoded = [value.encode('utf-8') if isinstance(value, str)
+               else (b'' if pd.isna(value) else str(value).encode('utf-8'))
+               for value in values]
+    width = max([len(value) for value in encoded] + [1])
+    return np.array(encoded, dtype=f'S{width}')
+
+
+def _decode(values):
+    return np.array([np.nan if value is None else value.decode('utf-8') for value in values],
+                    dtype=object)
+
+
+def _to_int64(values):
+    return pd.to_numeric(pd.Series(values), errors='raise').to_numpy(dtype=np.int64)
+
+
+def _id_strings(ids):
+    out = np.full(len(ids), np.nan, dtype=object)
+    found = ids >= 0
+    out[found] = ids[found].astype(str).tolist()
+    return out
+
+
+def _load(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays cannot be memory-mapped.
+        return np.load(path)
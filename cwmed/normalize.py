@@ -0,0 +1,136 @@
+"""
+Normalized matching of source codes that are not in the vocabulary as written.
+
+Source files often hold codes in another form than CONCEPT.csv: ICD codes without
+their dot (A044 for A04.4), lower case, NDCs with hyphens or with their leading zeros
+lost by a spreadsheet (7323001 for 00007323001), or billable codes more specific than
+any concept of the vocabulary. A CodeMatcher resolves such codes, all at once, to a
+concept_code of one vocabulary:
+
+* exact: the code is a concept_code of the vocabulary;
+* normalized: the code's normalized key (see `normalize_codes`) is the key of a concept_code;
+* parent: for hierarchical vocabularies (PARENT_PREFIX_LENGTHS), the longest prefix of
+  the code's key that is the key of a concept_code, e.g. A04.72 resolves to A04.7.
+
+Codes that resolve to nothing are 'unmatched' and keep their original value.
+"""
+import numpy as np
+import pandas as pd
+
+MATCH_TYPES = ('exact', 'normalized', 'parent', 'unmatched')
+
+# Vocabularies whose codes are padded to the 11-digit 5-4-2 NDC format.
+NDC_VOCABULARIES = ('NDC',)
+
+# Vocabularies whose codes fall back to their parent code, and the shortest parent
+# key, e.g. the 3-character ICD-10-CM category.
+PARENT_PREFIX_LENGTHS = {'ICD10CM': 3, 'ICD10': 3, 'ICD9CM': 3, 'ICD9Proc': 2}
+
+
+def normalize_codes(codes, vocabulary_id=None):
+    """
+    Return the normalized key of each code: upper case, without punctuation or spaces.
+
+    NDC codes are put in the 11-digit 5-4-2 format: each segment of a hyphenated code is
+    zero-padded (0002-3227-01 gives 00002322701) and a code of fewer than 11 digits is
+    assumed to have lost its leading zeros.
+
+    Args:
+        codes (array-like): Codes, NaN for missing.
+        vocabulary_id (str, optional): Vocabulary of the codes.
+
+    Returns: np.ndarray of str, NaN for missing codes.
+    """
+    codes = pd.Series(np.asarray(codes, dtype=object), dtype=object)
+    text = codes.where(codes.isnull(), codes.astype(str)).str.strip().str.upper()
+    keys = text.str.replace(r'[^0-9A-Z]', '', regex=True)
+
+    if vocabulary_id in NDC_VOCABULARIES:
+        short = keys.str.match(r'^\d{1,10}$', na=False)
+        keys = keys.where(~short, keys.str.zfill(11))
+        segments = text.str.extract(r'^(\d{1,5})[-\s](\d{1,4})[-\s](\d{1,2})$')
+        hyphenated = segments[0].notnull()
+        keys = keys.where(~hyphenated, segments[0].str.zfill(5) + segments[1].str.zfill(4) +
+                          segments[2].str.zfill(2))
+
+    return keys.to_numpy(dtype=object)
+
+
+class CodeMatcher:
+    """
+    Index of the concept codes of one vocabulary by code and by normalized key.
+
+    Attributes:
+        vocabulary_id (str): Vocabulary of the concept codes.
+        min_prefix (int): Shortest parent key, or None when codes do not fall back to
+                          their parent (see PARENT_PREFIX_LENGTHS).
+
+    Examples:
+    >>> matcher = cw.CodeMatcher(['A04.4', 'A04.7', 'C78.7'], 'ICD10CM')
+    >>> matcher.match(['A04.4', 'a044', 'A04.72', 'Z99'])
+    (array(['A04.4', 'A04.4', 'A04.7', 'Z99'], dtype=object),
+     array(['exact', 'normalized', 'parent', 'unmatched'], dtype=object))
+    """
+
+    def __init__(self, concept_codes, vocabulary_id=None):
+        self.vocabulary_id = vocabulary_id
+        self.min_prefix = PARENT_PREFIX_LENGTHS.get(vocabulary_id)
+        codes = np.sort(pd.unique(pd.Series(concept_codes, dtype=object).dropna()).astype(str))
+        codes = codes.astype(object)
+        keys = pd.Series(normalize_codes(codes, vocabulary_id))
+        # The smallest concept_code wins when several share a key.
+        first = ~keys.duplicated().to_numpy() & keys.notnull().to_numpy()
+        self._codes = pd.Index(codes)
+        self._keys = pd.Index(keys[first])
+        self._key_codes = codes[first]
+        self._max_length = int(keys.str.len().max()) if first.any() else 0
+
+    def match(self, codes):
+        """
+        Resolve codes to concept codes of the vocabulary.
+
+        Every distinct code is looked up once; each fallback is one vectorized probe
+        of the remaining codes (one per parent prefix length).
+
+        Args:
+            codes (array-like): Source codes, NaN for missing.
+
+        Returns: tuple of np.ndarray (matched codes, match types). A code that does not
+                 resolve keeps its value and has match type 'unmatched'.
+        """
+        inverse, uniques = pd.factorize(pd.Series(np.asarray(codes, dtype=object), dtype=object))
+        uniques = np.asarray(uniques, dtype=object)
+        matched = uniques.copy()
+        match_types = np.full(len(uniques), 'unmatched', dtype=object)
+
+        exact = self._codes.get_indexer(uniques) >= 0
+        match_types[exact] = 'exact'
+
+        keys = pd.Series(normalize_codes(uniques, self.vocabulary_id))
+        positions = np.where(exact, -1, self._keys.get_indexer(keys))
+        self._resolve(positions, 'normalized', matched, match_types)
+
+        if self.min_prefix is not None:
+            remaining = (match_types == 'unmatched') & keys.notnull().to_numpy()
+            lengths = keys.str.len().fillna(0).to_numpy()
+            # Longest parent first, so each code falls back to its nearest parent.
+            for length in range(self._max_length, self.min_prefix - 1, -1):
+                probe = np.flatnonzero(remaining & (lengths > length))
+                if not len(probe):
+                    continue
+                positions = np.full(len(uniques), -1, dtype=np.int64)
+                positions[probe] = self._keys.get_indexer(keys.iloc[probe].str[:length])
+                self._resolve(positions, 'parent', matched, match_types)
+                remaining &= positions < 0
+
+        found = inverse >= 0
+        out_codes = np.full(len(inverse), np.nan, dtype=object)
+        out_types = np.full(len(inverse), 'unmatched', dtype=object)
+        out_codes[found] = matched[inverse[found]]
+        out_types[found] = match_types[inverse[found]]
+        return out_codes, out_types
+
+    def _resolve(self, positions, match_type, matched, match_types):
+        hit = positions >= 0
+        matched[hit] = self._key_codes[positions[hit]]
+        match_types[hit] = match_type
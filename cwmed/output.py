@@ -0,0 +1,89 @@
+"""
+Writers and readers for the source to target tables in several file formats.
+
+* csv: the default, optionally compressed; the compression is inferred from the
+  extension (.gz, .bz2, .xz, .zip or .zst) unless given. Every column is read back
+  as strings, so codes keep their leading zeros.
+* parquet and feather: columnar files that keep the dtypes of the table, including the
+  categoricals and nullable Int64 ids of compact translators, so they load without
+  parsing. Both need pyarrow (`pip install cwmed[columnar]`).
+
+The format is inferred from the extension: .parquet or .pq for parquet, .feather or
+.arrow for feather and csv otherwise.
+"""
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'feather')
+
+# File extensions of the columnar formats; every other file is a CSV file.
+FORMAT_EXTENSIONS = {'.parquet': 'parquet', '.pq': 'parquet',
+                     '.feather': 'feather', '.arrow': 'feather'}
+
+
+def output_format(filepath, format=None):
+    """
+    Return the format of an output file: `format` when given, else the one its extension implies.
+    """
+    if format is None:
+        extension = os.path.splitext(os.fspath(filepath))[1].lower()
+        format = FORMAT_EXTENSIONS.get(extension, 'csv')
+    if format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format {format!r}. Expected one of {list(OUTPUT_FORMATS)}.')
+    if format != 'csv' and importlib.util.find_spec('pyarrow') is None:
+        raise ImportError(f'Writing and reading {format} files requires pyarrow: '
+                          f'pip install cwmed[columnar]')
+    return format
+
+
+def write_output(df, filepath, format=None, compression='infer'):
+    """
+    Write a source to target table without its index.
+
+    Args:
+        df (pd.DataFrame): Table to write.
+        filepath (str): Output file.
+        format (str, optional): 'csv', 'parquet' or 'feather'. Inferred from the extension when None.
+        compression (str, optional): Compression of the file, e.g. 'gzip' or 'zstd' for csv and
+                                     'snappy' or 'zstd' for parquet. 'infer' uses the extension
+                                     for csv and the pyarrow default for the columnar formats.
+    """
+    format = output_format(filepath, format)
+    if format == 'csv':
+        df.to_csv(filepath, index=False, compression=compression)
+        return
+
+    kwargs = {} if compression == 'infer' else {'compression': compression}
+    if format == 'parquet':
+        df.to_parquet(filepath, index=False, **kwargs)
+    else:
+        # Feather files cannot hold an index other than the default one.
+        df.reset_index(drop=True).to_feather(filepath, **kwargs)
+
+
+def read_output(filepath, format=None):
+    """
+    Read a table written by `write_output` or by the save functions of `VocabTranslator`.
+
+    Args:
+        filepath (str): Output file.
+        format (str, optional): 'csv', 'parquet' or 'feather'. Inferred from the extension when None.
+
+    Returns: pd.DataFrame. CSV columns are strings, with NaN for empty values.
+
+    Examples:
+    >>> vocab.save_all('out.parquet', 'failed.parquet')
+    >>> cw.read_output('out.parquet').dtypes
+    """
+    format = output_format(filepath, format)
+    if format == 'csv':
+        return pd.read_csv(filepath, dtype=str, keep_default_na=False, na_values=[''])
+
+    df = pd.read_parquet(filepath) if format == 'parquet' else pd.read_feather(filepath)
+    # pyarrow reads missing strings as None; the tables hold NaN.
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].where(df[column].notnull(), np.nan)
+    return df
@@ -0,0 +1,137 @@
+"""
+Readers for the Athena CONCEPT.csv and CONCEPT_RELATIONSHIP.csv files.
+
+Both readers load from the compiled cache when one is present (see `compile_vocab`)
+and parse the tab-separated file otherwise.
+"""
+import numpy as np
+import pandas as pd
+
+from cwmed.cache import load_table
+
+CONCEPT_RELATIONSHIP_COLUMNS = ['concept_id_1', 'concept_id_2', 'relationship_id']
+VALIDITY_COLUMNS = ['valid_end_date', 'invalid_reason']
+
+# Columns held as categoricals in the compact representation. Id columns become int64.
+CATEGORICAL_COLUMNS = ['vocabulary_id', 'domain_id', 'concept_class_id', 'standard_concept',
+                       'concept_code', 'relationship_id', 'invalid_reason']
+ID_COLUMNS = ['concept_id', 'concept_id_1', 'concept_id_2']
+
+
+def compact_frame(df):
+    """
+    Convert the id columns of a vocabulary table to int64 and its low-cardinality
+    string columns (and concept_code) to categoricals.
+
+    Args:
+        df (pd.DataFrame): Concepts or concept relationships.
+
+    Returns: pd.DataFrame with the compact dtypes.
+    """
+    dtypes = {}
+    for column in df.columns:
+        if column in ID_COLUMNS:
+            dtypes[column] = 'int64'
+        elif column in CATEGORICAL_COLUMNS:
+            dtypes[column] = 'category'
+    return df.astype(dtypes)
+
+
+def read_concept_file(concept_filepath, vocabs=None, columns=None, compact=False):
+    """
+    Read the CONCEPT.csv, keeping concept_id and concept_code as strings unless `compact`.
+
+    Args:
+        concept_filepath (str): Path to CONCEPT.csv.
+        vocabs (list, optional): Only keep concepts of these vocabulary_id's.
+        columns (list, optional): Only read these columns.
+        compact (bool): Return int64 concept_id's and categorical strings (see `compact_frame`).
+
+    Returns: pd.DataFrame with the concepts, indexed by their row in the file.
+    """
+    table = load_table(concept_filepath)
+    if table is not None:
+        mask = None if vocabs is None else table.isin("vocabulary_id", vocabs)
+        return table.to_frame(columns, mask,
+                              categorical=CATEGORICAL_COLUMNS if compact else None)
+
+    df = pd.read_csv(concept_filepath, sep='\t', usecols=columns,
+                     converters={"concept_id": str,
+                                 "concept_code": str})
+
+    # Select only the needed vocabulary_id's, e.g. 'ICD10CM' and 'SNOMED'.
+    if vocabs is not None:
+        df = df[df["vocabulary_id"].isin(vocabs)]
+
+    if compact:
+        df = compact_frame(df)
+
+    return df
+
+
+def read_concept_relationship_file(concept_relationship_filepath, concept_ids=None,
+                                   chunksize=1000000, compact=False, valid_on=None):
+    """
+    Read the "Maps to" rows of CONCEPT_RELATIONSHIP.csv.
+
+    The file is streamed in chunks of `chunksize` rows and only the concept_id_1,
+    concept_id_2 and relationship_id columns are parsed. Rows are filtered to the
+    "Maps to" relationship (and to `concept_ids`, when given) as each chunk is read,
+    so memory is bounded by the matching rows rather than the size of the file.
+
+    Args:
+        concept_relationship_filepath (str): Path to CONCEPT_RELATIONSHIP.csv.
+        concept_ids (array-like, optional): Source concept_id's to keep in concept_id_1.
+                                            All concept_id_1 values are kept when None.
+        chunksize (int): Number of rows parsed at a time.
+        compact (bool): Return int64 concept_id's and a categorical relationship_id.
+        valid_on (int, optional): Date as YYYYMMDD. When given, rows with an invalid_reason
+                                  or a valid_end_date before this date are dropped.
+
+    Returns: pd.DataFrame with concept_id_1, concept_id_2 and relationship_id.
+    """
+    columns = CONCEPT_RELATIONSHIP_COLUMNS
+    if concept_ids is not None:
+        concept_ids = pd.Index(concept_ids).unique()
+        if compact:
+            concept_ids = pd.Index(pd.to_numeric(concept_ids).astype('int64'))
+
+    table = load_table(concept_relationship_filepath)
+    if table is not None:
+        mask = table.isin('relationship_id', ["Maps to"])
+        if valid_on is not None:
+            # Missing invalid_reason values are stored as code -1.
+            mask &= np.asarray(table.values('invalid_reason')) == -1
+            mask &= np.asarray(table.values('valid_end_date')) >= valid_on
+        if concept_ids is not None:
+            mask = table.isin('concept_id_1', concept_ids, where=mask)
+        return table.to_frame(columns, mask,
+                              categorical=CATEGORICAL_COLUMNS if compact else None
+                              ).reset_index(drop=True)
+
+    validity_columns = VALIDITY_COLUMNS if valid_on is not None else []
+    reader = pd.read_csv(concept_relationship_filepath, sep='\t',
+                         usecols=columns + validity_columns, dtype=str,
+                         chunksize=chunksize)
+    chunks = []
+    for chunk in reader:
+        keep = chunk['relationship_id'] == "Maps to"
+        if valid_on is not None:
+            keep &= (chunk['invalid_reason'].isnull() &
+                     (pd.to_numeric(chunk['valid_end_date']) >= valid_on))
+        chunk = chunk.loc[keep, columns]
+        if compact:
+            chunk = chunk.astype({'concept_id_1': 'int64', 'concept_id_2': 'int64'})
+        if concept_ids is not None:
+            chunk = chunk[chunk['concept_id_1'].isin(concept_ids)]
+        chunks.append(chunk)
+
+    if not chunks:
+        df = pd.DataFrame(columns=columns, dtype=str)
+    else:
+        df = pd.concat(chunks, ignore_index=True)
+
+    if compact:
+        df = compact_frame(df)
+
+    return df
@@ -0,0 +1,343 @@
+"""
+Local HTTP server that keeps one vocabulary index in memory for many clients.
+
+The server loads CONCEPT.csv and CONCEPT_RELATIONSHIP.csv once (see `VocabStore`) and
+answers batched translate requests with `VocabIndex.lookup_many`, which builds the same
+table as `VocabTranslator`. Requests arriving within `max_batch_wait` seconds of each
+other are coalesced: their distinct codes are looked up together, once per pair of
+vocabularies, and the result is split back per request.
+
+Endpoints:
+
+* POST /translate with a JSON body {"codes": [...], "source_vocab_value": "ICD10CM",
+  "target_vocab_value": "SNOMED", "max_hops": 1} returns the table as
+  {"columns": [...], "data": [[...], ...]}, with null for missing values.
+* GET /stats returns the number of requests and batches and the latency percentiles.
+* GET /health returns {"status": "ok"}.
+
+Run it with:
+
+    python -m cwmed.server CONCEPT.csv CONCEPT_RELATIONSHIP.csv --port 8765 --vocabs ICD10CM SNOMED
+
+and query it with `VocabClient('http://127.0.0.1:8765').translate(codes, 'ICD10CM', 'SNOMED')`.
+"""
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+# Latencies kept for the percentiles reported by /stats.
+LATENCY_WINDOW = 10000
+
+
+class VocabServer:
+    """
+    Serve batched translations from one VocabStore over HTTP.
+
+    Attributes:
+        store (VocabStore): Vocabulary the requests are translated with.
+        host (str): Address to listen on.
+        port (int): Port to listen on; 0 picks a free port, see `url`.
+        max_batch_wait (float): Seconds a request waits for others to share its lookup.
+        max_batch_codes (int): A batch is looked up as soon as it holds this many codes.
+        request_timeout (float): Seconds a request waits for its batch to be looked up.
+
+    Examples:
+    >>> store = cw.VocabStore('CONCEPT.csv', 'CONCEPT_RELATIONSHIP.csv', vocabs=['ICD10CM', 'SNOMED'])
+    >>> server = VocabServer(store, port=8765).start()
+    >>> VocabClient(server.url).translate(['A04.4'], 'ICD10CM', 'SNOMED')
+    	ICD10CM	 ICD10CM_label	   ICD10CM_omop_id	SNOMED	   SNOMED_label	     SNOMED_omop_id
+    0	 A04.4	 Other intestinal    35205417	   111839008    Intestinal           192815
+    >>> server.shutdown()
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=8765, max_batch_wait=0.002,
+                 max_batch_codes=100000, request_timeout=60):
+        self.store = store
+        self.max_batch_wait = max_batch_wait
+        self.max_batch_codes = max_batch_codes
+        self.request_timeout = request_timeout
+        self._index = store.index()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._counts = {'requests': 0, 'errors': 0, 'batches': 0, 'batched_requests': 0,
+                        'batched_codes': 0}
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._threads = []
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """
+        Serve in background threads and return the server.
+        """
+        self._threads = [threading.Thread(target=self._batch_loop, daemon=True),
+                         threading.Thread(target=self._httpd.serve_forever, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serve until interrupted.
+        """
+        batcher = threading.Thread(target=self._batch_loop, daemon=True)
+        batcher.start()
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._queue.put(None)
+            self._httpd.server_close()
+
+    def shutdown(self):
+        """
+        Stop serving and wait for the background threads started by `start`.
+        """
+        self._httpd.shutdown()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._httpd.server_close()
+
+    def translate(self, codes, source_vocab_value, target_vocab_value, max_hops=1):
+        """
+        Translate codes in the next batch and wait for the result.
+
+        Returns: pd.DataFrame like `VocabIndex.lookup_many`.
+
+        Raises:
+            TypeError: The vocabularies are not strings, codes is not a list or max_hops not an int.
+            ValueError: The source and target vocabulary are the same.
+            TimeoutError: The batch was not looked up within `request_timeout` seconds.
+        """
+        # Malformed requests are rejected here, before they can reach the batch thread.
+        if not isinstance(source_vocab_value, str) or not isinstance(target_vocab_value, str):
+            raise TypeError('The source and target vocabulary must be strings.')
+        if not isinstance(codes, list):
+            raise TypeError('codes must be a list of codes.')
+        if not isinstance(max_hops, int) or isinstance(max_hops, bool):
+            raise TypeError('max_hops must be an integer.')
+        if source_vocab_value == target_vocab_value:
+            raise ValueError('The source and target vocabulary must differ.')
+        future = concurrent.futures.Future()
+        codes = [code if code is None or isinstance(code, str) else str(code) for code in codes]
+        self._queue.put(((source_vocab_value, target_vocab_value, max_hops), codes, future))
+        return future.result(timeout=self.request_timeout)
+
+    def _batch_loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            codes = len(item[1])
+            deadline = time.perf_counter() + self.max_batch_wait
+            while codes < self.max_batch_codes:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                codes += len(item[1])
+            self._lookup(batch, codes)
+
+    def _lookup(self, batch, codes):
+        """
+        Look up the distinct codes of each vocabulary pair in a batch once and
+        set the result of every request. A failure sets the exception of the requests
+        it affects, so the batch thread keeps running.
+        """
+        try:
+            groups = {}
+            for key, request_codes, future in batch:
+                groups.setdefault(key, []).append((request_codes, future))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            groups = {}
+
+        for (source_vocab_value, target_vocab_value, max_hops), pending in groups.items():
+            try:
+                distinct = pd.unique(pd.Series([code for request_codes, _ in pending
+                                                 for code in request_codes], dtype=object).dropna())
+                result = self._index.lookup_many(distinct, source_vocab_value, target_vocab_value,
+                                                 max_hops)
+                for request_codes, future in pending:
+                    # Every code has at least one row, so the left merge keeps the
+                    # rows of `lookup_many(request_codes)` in the same order.
+                    df = pd.DataFrame({source_vocab_value: pd.Series(request_codes, dtype=object)})
+                    future.set_result(df.merge(result, how='left', on=source_vocab_value))
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+        with self._lock:
+            self._counts['batches'] += 1
+            self._counts['batched_requests'] += len(batch)
+            self._counts['batched_codes'] += codes
+
+    def _record(self, seconds, error=False):
+        with self._lock:
+            self._counts['requests'] += 1
+            self._counts['errors'] += error
+            self._latencies.append(seconds)
+
+    def stats(self):
+        """
+        Summarize the requests served so far.
+
+        Returns: dict with the number of requests, errors and batches, the mean requests
+                 and codes per batch, and the 50th, 90th and 99th percentile latency in
+                 milliseconds over the last LATENCY_WINDOW requests.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = np.array(self._latencies) * 1000
+        batches = counts.pop('batches')
+        stats = {'requests': counts['requests'],
+                 'errors': counts['errors'],
+                 'batches': batches,
+                 'requests_per_batch': counts['batched_requests'] / batches if batches else 0.0,
+                 'codes_per_batch': counts['batched_codes'] / batches if batches else 0.0}
+        for percentile in (50, 90, 99):
+            stats[f'p{percentile}_ms'] = (float(np.percentile(latencies, percentile))
+                                          if len(latencies) else None)
+        return stats
+
+
+def _handler(server):
+    """
+    Return the request handler class of a VocabServer.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status, payload):
+            body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send(200, server.stats())
+            elif self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            else:
+                self._send(404, {'error': f'Unknown path {self.path}.'})
+
+        def do_POST(self):
+            if self.path != '/translate':
+                self._send(404, {'error': f'Unknown path {self.path}.'})
+                return
+            start = time.perf_counter()
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                df = server.translate(request['codes'], request['source_vocab_value'],
+                                      request['target_vocab_value'], request.get('max_hops', 1))
+            except (ValueError, KeyError, TypeError) as e:
+                server._record(time.perf_counter() - start, error=True)
+                self._send(400, {'error': str(e)})
+                return
+            except Exception as e:
+                server._record(time.perf_counter() - start, error=True)
+                self._send(500, {'error': f'{type(e).__name__}: {e}'})
+                return
+            body = df.to_json(orient='split', index=False)
+            server._record(time.perf_counter() - start)
+            self._send(200, body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class VocabClient:
+    """
+    Translate codes with a VocabServer.
+
+    Attributes:
+        url (str): Address of the server, e.g. 'http://127.0.0.1:8765'.
+        timeout (float): Seconds to wait for a response.
+    """
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def translate(self, codes, source_vocab_value, target_vocab_value, max_hops=1):
+        """
+        Translate source codes to the target vocabulary.
+
+        Returns: pd.DataFrame like `VocabIndex.lookup_many`.
+        """
+        response = self._session.post(f'{self.url}/translate', timeout=self.timeout,
+                                      json={'codes': list(codes),
+                                            'source_vocab_value': source_vocab_value,
+                                            'target_vocab_value': target_vocab_value,
+                                            'max_hops': max_hops})
+        if response.status_code == 400:
+            raise ValueError(response.json()['error'])
+        response.raise_for_status()
+        payload = response.json()
+        return pd.DataFrame(payload['data'], columns=payload['columns'], dtype=object)
+
+    def stats(self):
+        """
+        Return the server's `VocabServer.stats`.
+        """
+        response = self._session.get(f'{self.url}/stats', timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve batched vocabulary translations over HTTP.')
+    parser.add_argument('concept_filepath', help='path to CONCEPT.csv')
+    parser.add_argument('concept_relationship_filepath', help='path to CONCEPT_RELATIONSHIP.csv')
+    parser.add_argument('--vocabs', nargs='+', help='only load these vocabulary_id values')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-wait', type=float, default=0.002,
+                        help='seconds a request waits for others to share its lookup')
+    args = parser.parse_args(argv)
+
+    from cwmed import VocabStore
+
+    store = VocabStore(args.concept_filepath, args.concept_relationship_filepath, vocabs=args.vocabs)
+    server = VocabServer(store, host=args.host, port=args.port, max_batch_wait=args.max_batch_wait)
+    print(f"Serving {server.url} (loaded in {store.load_seconds:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Seeded generator of synthetic Athena vocabularies and source files.
+
+The files have the columns, tab separation and shape of an Athena release: a few
+vocabularies hold most concepts, non-standard concepts have "Maps to" relationships
+to standard concepts (a few to several targets, a few to none), standard concepts map
+to themselves, and most relationships are of other types. Source files draw their
+codes with a Zipf skew, so a few codes repeat many times, and include unknown codes.
+
+A real release has about 5M concepts and 40M relationships:
+
+>>> from cwmed.synthetic import generate_vocabulary, generate_source_file
+>>> generate_vocabulary('athena/', concepts=5000000, relationships_per_concept=8)
+>>> generate_source_file('athena/', 'athena/icd10cm.csv', 'ICD10CM', rows=1000000)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from cwmed.readers import CONCEPT_RELATIONSHIP_COLUMNS
+
+CONCEPT_COLUMNS = ['concept_id', 'concept_name', 'domain_id', 'vocabulary_id', 'concept_class_id',
+                   'standard_concept', 'concept_code', 'valid_start_date', 'valid_end_date',
+                   'invalid_reason']
+
+ICD10PCS_ALPHABET = '0123456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+
+# vocabulary_id: (share of concepts, standard_concept, domain_id, concept_class_id, code format).
+# Every code format is one-to-one on the position of the concept within its vocabulary.
+VOCABULARIES = {
+    'RxNorm Extension': (0.39, 'S', 'Drug', 'Clinical Drug', lambda i: f'OMOP{400000 + i}'),
+    'SNOMED': (0.20, 'S', 'Condition', 'Clinical Finding', lambda i: str(100000 + 13 * i)),
+    'NDC': (0.20, '', 'Drug', '11-digit NDC', lambda i: f'{7919 * i % 10 ** 11:011d}'),
+    'RxNorm': (0.06, 'S', 'Drug', 'Clinical Drug', lambda i: str(1000 + 3 * i)),
+    'LOINC': (0.06, 'S', 'Measurement', 'Lab Test', lambda i: f'{1000 + i}-{i % 10}'),
+    'ICD10PCS': (0.04, '', 'Procedure', 'ICD10PCS',
+                 lambda i: ''.join(ICD10PCS_ALPHABET[i // 34 ** k % 34] for k in range(7))),
+    'ICD10CM': (0.02, '', 'Condition', '4-char billing code',
+                lambda i: f'{chr(65 + i % 26)}{i // 26 % 100:02d}.{i // 2600 % 10}{i // 26000 or ""}'),
+    'ICD9CM': (0.01, '', 'Condition', '4-dig billing code', lambda i: f'{i % 1000:03d}.{i // 1000}'),
+    'CPT4': (0.01, 'S', 'Procedure', 'CPT4', lambda i: f'{10000 + i:05d}'),
+    'HCPCS': (0.01, 'S', 'Procedure', 'HCPCS', lambda i: f'{chr(65 + i % 26)}{i // 26:04d}'),
+}
+
+# Standard vocabularies that the concepts of each non-standard vocabulary map to, with weights.
+MAPS_TO = {
+    'NDC': {'RxNorm': 0.7, 'RxNorm Extension': 0.3},
+    'ICD10CM': {'SNOMED': 1.0},
+    'ICD9CM': {'SNOMED': 1.0},
+    'ICD10PCS': {'SNOMED': 0.6, 'CPT4': 0.4},
+}
+
+# Other relationship types, which make up the rest of CONCEPT_RELATIONSHIP.csv.
+OTHER_RELATIONSHIPS = [('Is a', 'Subsumes'), ('Has ingredient', 'Ingredient of'),
+                       ('Has dose form', 'Dose form of'), ('Has asso morph', 'Asso morph of')]
+
+
+def _zipf_choice(rng, n, size, a=1.1):
+    """
+    Draw `size` positions in range(n) with a Zipf skew over a random order of the positions.
+    """
+    ranks = (rng.zipf(a, size) - 1) % n
+    return rng.permutation(n)[ranks]
+
+
+def _concepts(rng, concepts):
+    counts = {vocab: max(1, int(round(share * concepts)))
+              for vocab, (share, *_) in VOCABULARIES.items()}
+    frames = []
+    for vocab, (_, standard, domain, concept_class, code) in VOCABULARIES.items():
+        n = counts[vocab]
+        frames.append(pd.DataFrame({
+            'concept_name': [f'Synthetic {vocab} {domain.lower()} concept {i}' for i in range(n)],
+            'domain_id': domain,
+            'vocabulary_id': vocab,
+            'concept_class_id': concept_class,
+            'standard_concept': standard,
+            'concept_code': [code(i) for i in range(n)],
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    # Athena concept_id's are unique but not contiguous nor ordered by vocabulary.
+    df.insert(0, 'concept_id', rng.permutation(2 * len(df))[:len(df)] + 1)
+    df['valid_start_date'] = 19700101
+    df['valid_end_date'] = 20991231
+    df['invalid_reason'] = ''
+    return df[CONCEPT_COLUMNS]
+
+
+def _maps_to(rng, df, unmapped=0.05, one_to_many=0.08):
+    """
+    Return the concept_id_1 and concept_id_2 arrays of the "Maps to" relationships.
+    """
+    ids = df['concept_id'].to_numpy()
+    vocabs = df['vocabulary_id'].to_numpy()
+    standard = df['standard_concept'].to_numpy() == 'S'
+
+    # Standard concepts map to themselves.
+    sources = [ids[standard]]
+    targets = [ids[standard]]
+    for vocab, weights in MAPS_TO.items():
+        source_ids = ids[vocabs == vocab]
+        source_ids = source_ids[rng.random(len(source_ids)) >= unmapped]
+        # Some source concepts map to several target concepts.
+        source_ids = np.concatenate([source_ids,
+                                     source_ids[rng.random(len(source_ids)) < one_to_many]])
+        target_vocabs = rng.choice(list(weights), size=len(source_ids), p=list(weights.values()))
+        for target_vocab in weights:
+            chosen = source_ids[target_vocabs == target_vocab]
+            target_ids = ids[vocabs == target_vocab]
+            sources.append(chosen)
+            targets.append(target_ids[_zipf_choice(rng, len(target_ids), len(chosen))])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def generate_vocabulary(directory, concepts=100000, relationships_per_concept=8, seed=0,
+                        chunksize=1000000):
+    """
+    Write a synthetic CONCEPT.csv and CONCEPT_RELATIONSHIP.csv to a directory.
+
+    Args:
+        directory (str): Output directory, created if needed.
+        concepts (int): Approximate number of concepts.
+        relationships_per_concept (int): Approximate number of relationships per concept,
+                                         of which about two are "Maps to" and "Mapped from".
+        seed (int): Seed of the random generator; the same seed writes the same files.
+        chunksize (int): Number of relationships generated and written at a time.
+
+    Returns: tuple with the paths to CONCEPT.csv and CONCEPT_RELATIONSHIP.csv.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    concept_filepath = os.path.join(directory, 'CONCEPT.csv')
+    concept_relationship_filepath = os.path.join(directory, 'CONCEPT_RELATIONSHIP.csv')
+
+    df = _concepts(rng, concepts)
+    df.to_csv(concept_filepath, sep='\t', index=False)
+
+    concept_id_1, concept_id_2 = _maps_to(rng, df)
+    ids = df['concept_id'].to_numpy()
+    other = max(0, relationships_per_concept * len(df) - 2 * len(concept_id_1))
+
+    columns = CONCEPT_RELATIONSHIP_COLUMNS + ['valid_start_date', 'valid_end_date', 'invalid_reason']
+    with open(concept_relationship_filepath, 'w', newline='') as f:
+        pd.DataFrame(columns=columns).to_csv(f, sep='\t', index=False)
+        for start in range(0, len(concept_id_1), chunksize):
+            stop = start + chunksize
+            for relationship, first, second in (('Maps to', concept_id_1, concept_id_2),
+                                                ('Mapped from', concept_id_2, concept_id_1)):
+                _write_relationships(f, first[start:stop], second[start:stop], relationship)
+        # Other relationships come in pairs of a relationship and its reverse.
+        for start in range(0, other // 2, chunksize):
+            n = min(chunksize, other // 2 - start)
+            kinds = rng.integers(len(OTHER_RELATIONSHIPS), size=n)
+            first = ids[rng.integers(len(ids), size=n)]
+            second = ids[_zipf_choice(rng, len(ids), n)]
+            for kind, (relationship, reverse) in enumerate(OTHER_RELATIONSHIPS):
+                chosen = kinds == kind
+                _write_relationships(f, first[chosen], second[chosen], relationship)
+                _write_relationships(f, second[chosen], first[chosen], reverse)
+
+    return concept_filepath, concept_relationship_filepath
+
+
+def _write_relationships(f, concept_id_1, concept_id_2, relationship_id):
+    pd.DataFrame({'concept_id_1': concept_id_1,
+                  'concept_id_2': concept_id_2,
+                  'relationship_id': relationship_id,
+                  'valid_start_date': 19700101,
+                  'valid_end_date': 20991231,
+                  'invalid_reason': ''}).to_csv(f, sep='\t', index=False, header=False)
+
+
+def generate_source_file(directory, source_filepath, vocabulary_id, rows=10000, unknown=0.02,
+                         source_code_col=None, seed=0):
+    """
+    Write a source file of codes drawn from one vocabulary of a synthetic CONCEPT.csv.
+
+    Args:
+        directory (str): Directory holding the CONCEPT.csv written by `generate_vocabulary`.
+        source_filepath (str): Path to the source file to write.
+        vocabulary_id (str): Vocabulary the codes are drawn from, e.g. 'ICD10CM' or 'NDC'.
+        rows (int): Number of rows.
+        unknown (float): Share of rows holding codes that are not in the vocabulary.
+        source_code_col (str, optional): Name of the code column. Defaults to the
+                                         lowercase vocabulary_id.
+        seed (int): Seed of the random generator.
+
+    Returns: str, the name of the code column.
+    """
+    rng = np.random.default_rng(seed)
+    source_code_col = source_code_col or vocabulary_id.lower()
+    df = pd.read_csv(os.path.join(directory, 'CONCEPT.csv'), sep='\t',
+                     usecols=['vocabulary_id', 'concept_code'], dtype=str)
+    codes = df.loc[df['vocabulary_id'] == vocabulary_id, 'concept_code'].to_numpy()
+    if len(codes) == 0:
+        raise ValueError(f'No {vocabulary_id} concepts in {directory}.')
+
+    sample = codes[_zipf_choice(rng, len(codes), rows)].astype(object)
+    missing = rng.random(rows) < unknown
+    sample[missing] = [f'UNKNOWN{i}' for i in rng.integers(rows, size=missing.sum())]
+    pd.DataFrame({source_code_col: sample}).to_csv(source_filepath, index=False)
+    return source_code_col
@@ -1,10 +1,18 @@
+import http.server
+import importlib.util
+import io
 import os
+import shutil
 import tempfile
+import threading
 import unittest
+from unittest import mock
+import zipfile
 
 import numpy as np
 import pandas as pd
-from pandas.testing import assert_frame_equal
+import requests
+from pandas.testing import assert_frame_equal, assert_series_equal
 import filecmp
 
 import cwmed as cw
@@ -83,6 +91,50 @@ class TestCW(unittest.TestCase):
         self._compare_csvfiles(self.output_path,'tests/data/expected/icd10_to_snomed_failed_mappings.csv')
         assert_frame_equal(result, expected)
 
+    def test_save_all_writes_both_files_in_one_call(self):
+        """
+        Tests that save_all writes the same files as the two save functions, that
+        compressed CSV files read back as the table, and that mapped_only splits it.
+        """
+        failed_path = os.path.join(self.temp_path_to_directory, 'failed.csv')
+        counts = self.vocab.save_all(self.output_path, failed_path)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed.csv')
+        self._compare_csvfiles(failed_path, 'tests/data/expected/icd10_to_snomed_failed_mappings.csv')
+        table = self.vocab.target_table
+        self.assertEqual(counts['mapped_rows'] + counts['failed_rows'], len(table))
+
+        output_path = os.path.join(self.temp_path_to_directory, 'output.csv.gz')
+        failed_path = os.path.join(self.temp_path_to_directory, 'failed.csv.gz')
+        self.vocab.save_all(output_path, failed_path, mapped_only=True)
+        mapped = cw.read_output(output_path)
+        failed = cw.read_output(failed_path)
+        self.assertEqual((len(mapped), len(failed)), (counts['mapped_rows'], counts['failed_rows']))
+        self.assertTrue(mapped['SNOMED_omop_id'].notnull().all())
+        assert_frame_equal(pd.concat([mapped, failed]).sort_values(list(table.columns))
+                           .reset_index(drop=True),
+                           table.sort_values(list(table.columns)).reset_index(drop=True))
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+    def test_columnar_output_keeps_dtypes(self):
+        """
+        Tests that Parquet and Feather files of a compact translator read back with the
+        dtypes of its table.
+        """
+        vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/icd10.csv',
+                        source_code_col = 'icd10',
+                        concept_filepath = 'tests/data/input/icd10_to_snomed_concept.csv',
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = 'tests/data/input/icd10_to_snomed_concept_relationship.csv',
+                        compact = True)
+        for extension in ('parquet', 'feather'):
+            output_path = os.path.join(self.temp_path_to_directory, f'output.{extension}')
+            failed_path = os.path.join(self.temp_path_to_directory, f'failed.{extension}')
+            vocab.save_all(output_path, failed_path)
+            assert_frame_equal(cw.read_output(output_path), vocab.target_table)
+            failed = vocab.target_table[vocab.target_table['SNOMED_omop_id'].isnull()]
+            assert_frame_equal(cw.read_output(failed_path), failed.reset_index(drop=True))
+
     def _compare_csvfiles(self,file1,file2):
         """
         Compares two CSV files and asserts that they are identical.
@@ -93,6 +145,613 @@ class TestCW(unittest.TestCase):
         """
         self.assertTrue(filecmp.cmp(file1, file2))
 
+    def test_read_concept_relationship_file_streams_maps_to_rows(self):
+        """
+        Tests that streaming CONCEPT_RELATIONSHIP.csv one row at a time keeps only
+        "Maps to" relationships and, when given, only the requested concept_id_1 values.
+        """
+        self.vocab.chunksize = 1
+        result = self.vocab._read_concept_relationship_file()
+        self.assertEqual(list(result.columns), ['concept_id_1', 'concept_id_2', 'relationship_id'])
+        self.assertEqual(result['concept_id_1'].tolist(), ['35205417'])
+        self.assertEqual(result['concept_id_2'].tolist(), ['192815'])
+
+        result = self.vocab._read_concept_relationship_file(concept_ids=['35206332'])
+        self.assertTrue(result.empty)
+
+    def test_translate_codes_without_source_file(self):
+        """
+        Tests that a VocabTranslator built without a source file translates codes held
+        in memory, with the same rows as the source to target table.
+        """
+        vocab = cw.VocabTranslator(source_filepath = None,
+                        source_code_col = None,
+                        concept_filepath = 'tests/data/input/icd10_to_snomed_concept.csv',
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = 'tests/data/input/icd10_to_snomed_concept_relationship.csv')
+        self.assertIsNone(vocab.target_table)
+
+        result = vocab.translate(['A04.4', 'C78.7'])
+        self.assertEqual(result['SNOMED'].tolist()[0], '111839008')
+        self.assertTrue(pd.isna(result['SNOMED_omop_id'].tolist()[1]))
+
+        codes = self.vocab._read_source_file()['icd10']
+        assert_frame_equal(vocab.translate(codes),
+                           self.vocab.target_table.reset_index(drop=True))
+        assert_frame_equal(vocab.translate(np.array(codes)),
+                           self.vocab.target_table.reset_index(drop=True))
+
+    def test_translate_memoizes_small_calls(self):
+        """
+        Tests that repeated small translate calls are served from the memo and that
+        changing a returned table does not change later results.
+        """
+        first = self.vocab.translate(['A04.4'])
+        first.loc[0, 'SNOMED'] = 'changed'
+        second = self.vocab.translate(['A04.4'])
+        self.assertEqual(second.loc[0, 'SNOMED'], '111839008')
+        self.assertEqual(self.vocab._translate_memo.cache_info().hits, 1)
+
+    def test_translate_file_in_chunks_matches_saved_files(self):
+        """
+        Tests that translating the source file in chunks writes the same source to target
+        and failed mappings files as the save functions, reports the throughput, and
+        only counts the failed mappings when they are not saved.
+        """
+        failed_path = os.path.join(self.temp_path_to_directory, 'failed.csv')
+        stats = self.vocab.translate_file(self.output_path, failed_path, chunksize=50)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed.csv')
+        self._compare_csvfiles(failed_path, 'tests/data/expected/icd10_to_snomed_failed_mappings.csv')
+        self.assertEqual(stats['rows'], 451)
+        self.assertEqual(stats['failed_rows'], 450)
+        self.assertGreater(stats['rows_per_second'], 0)
+
+        # A source file with only a header gives files with only the header.
+        source_path = os.path.join(self.temp_path_to_directory, 'empty.csv')
+        with open(source_path, 'w') as f:
+            f.write('icd10\n')
+        stats = self.vocab.translate_file(self.output_path, failed_path, source_filepath=source_path)
+        self.assertEqual(stats['rows'], 0)
+        header = 'ICD10CM,ICD10CM_label,ICD10CM_omop_id,SNOMED,SNOMED_label,SNOMED_omop_id\n'
+        for path in (self.output_path, failed_path):
+            with open(path) as f:
+                self.assertEqual(f.read(), header)
+
+        # Without a failed mappings file only the output rows are written.
+        with mock.patch.object(pd.DataFrame, 'to_csv', autospec=True,
+                               side_effect=pd.DataFrame.to_csv) as to_csv:
+            stats = self.vocab.translate_file(self.output_path, chunksize=50)
+        self.assertEqual(to_csv.call_count, 10)
+        self.assertEqual(stats['failed_rows'], 450)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed.csv')
+
+    def test_translate_files_in_parallel_matches_saved_files(self):
+        """
+        Tests that translating partitions of the source files on a process pool writes
+        the same files as the save functions.
+        """
+        output_paths = [os.path.join(self.temp_path_to_directory, f'out_{i}.csv') for i in range(2)]
+        failed_paths = [os.path.join(self.temp_path_to_directory, f'failed_{i}.csv') for i in range(2)]
+        stats = self.vocab.translate_files(['tests/data/input/icd10.csv'] * 2,
+                                           output_paths, failed_paths,
+                                           workers=2, partitions=3, chunksize=40)
+        for output_path, failed_path in zip(output_paths, failed_paths):
+            self._compare_csvfiles(output_path, 'tests/data/expected/icd10_to_snomed.csv')
+            self._compare_csvfiles(failed_path, 'tests/data/expected/icd10_to_snomed_failed_mappings.csv')
+        self.assertEqual(stats['rows'], 902)
+
+    def test_vocab_store_serves_translators_and_wide_table(self):
+        """
+        Tests that translators created from a VocabStore build the same source to target
+        table as a VocabTranslator parsing the files, and that the wide table holds one
+        block of columns per target vocabulary.
+        """
+        store = cw.VocabStore('tests/data/input/icd10_to_snomed_concept.csv',
+                              'tests/data/input/icd10_to_snomed_concept_relationship.csv')
+        vocab = store.translator('ICD10CM', 'SNOMED',
+                                 source_filepath='tests/data/input/icd10.csv',
+                                 source_code_col='icd10')
+        vocab.save_source_to_target(self.output_path)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed.csv')
+
+        wide = store.translate(['A04.4', 'C78.7'], 'ICD10CM', ['SNOMED', 'LOINC'])
+        self.assertEqual(list(wide.columns),
+                         ['ICD10CM', 'ICD10CM_label', 'SNOMED', 'SNOMED_label', 'SNOMED_omop_id',
+                          'LOINC', 'LOINC_label', 'LOINC_omop_id'])
+        self.assertEqual(wide['SNOMED'].tolist()[0], '111839008')
+        self.assertEqual(wide['SNOMED_omop_id'].isnull().tolist(), [False, True])
+        self.assertTrue(wide['LOINC'].isnull().all())
+
+        stats = store.stats()
+        self.assertEqual(stats['pairs'], 2)
+        self.assertGreaterEqual(stats['estimated_saved_seconds'], 0)
+        self.assertEqual(stats['estimated_separate_load_seconds'], stats['load_seconds'] * 2)
+
+    def test_vocab_store_translates_columns_of_a_wide_table(self):
+        """
+        Tests that translate_columns gives each code column the first target a translator
+        for its own source vocabulary finds, or all of them with multiple='all', with the
+        number of targets, looking up shared codes only once and keeping one row per input
+        row with its index.
+        """
+        from cwmed.synthetic import generate_vocabulary, generate_source_file
+
+        concept_path, concept_relationship_path = generate_vocabulary(self.temp_path_to_directory,
+                                                                      concepts=5000)
+        columns = {'icd10_code': 'ICD10CM', 'icd10_secondary': 'ICD10CM', 'ndc': 'NDC'}
+        table = {}
+        for seed, (column, source_vocab_value) in enumerate(columns.items()):
+            source_path = os.path.join(self.temp_path_to_directory, f'{column}.csv')
+            generate_source_file(self.temp_path_to_directory, source_path, source_vocab_value,
+                                 rows=300, source_code_col=column, seed=seed)
+            table[column] = pd.read_csv(source_path, dtype=str)[column]
+        table = pd.DataFrame(table).set_axis(range(42, 342))
+        table.loc[::7, 'icd10_secondary'] = np.nan
+
+        store = cw.VocabStore(concept_path, concept_relationship_path)
+        targets = {'icd10_code': 'SNOMED', 'icd10_secondary': 'SNOMED', 'ndc': 'RxNorm'}
+        with mock.patch.object(cw.VocabIndex, 'lookup_many', autospec=True,
+                               side_effect=cw.VocabIndex.lookup_many) as lookup_many:
+            wide = store.translate_columns(table, columns, targets)
+        self.assertEqual(lookup_many.call_count, 2)
+
+        every_target = store.translate_columns(table, columns, targets, multiple='all')
+        self.assertEqual(list(wide.columns[:3]), list(columns))
+        assert_frame_equal(wide[list(columns)], table)
+        assert_frame_equal(every_target[list(columns)], table)
+        for column, source_vocab_value in columns.items():
+            target = targets[column]
+            expected = store.translator(source_vocab_value, target).translate(
+                table[column].dropna().unique())
+            self.assertTrue(expected[source_vocab_value].duplicated().any())
+
+            # A code with several targets is counted, and kept in full with multiple='all'.
+            omop_ids = expected.dropna(subset=[f'{target}_omop_id']).groupby(
+                source_vocab_value)[f'{target}_omop_id'].agg(list)
+            n_targets = table[column].map(omop_ids.str.len()).fillna(0).astype('int64')
+            self.assertTrue((n_targets > 1).any())
+            assert_series_equal(wide[f'{column}_{target}_n_targets'], n_targets, check_names=False)
+            assert_series_equal(every_target[f'{column}_{target}_n_targets'], n_targets,
+                                check_names=False)
+            assert_series_equal(every_target[f'{column}_{target}_omop_id'], table[column].map(omop_ids),
+                                check_names=False)
+
+            expected = expected[[source_vocab_value, target, f'{target}_omop_id']].drop_duplicates(
+                source_vocab_value)
+            result = wide[[column, f'{column}_{target}', f'{column}_{target}_omop_id']].dropna(
+                subset=[column]).drop_duplicates()
+            assert_frame_equal(result.sort_values(list(result.columns)).reset_index(drop=True),
+                               expected.set_axis(list(result.columns), axis=1)
+                               .sort_values(list(result.columns)).reset_index(drop=True))
+        self.assertTrue(wide.loc[wide['icd10_secondary'].isnull(), 'icd10_secondary_SNOMED'].isnull().all())
+        with self.assertRaises(ValueError):
+            store.translate_columns(table, columns, targets, multiple='last')
+
+    def test_vocab_store_refreshes_from_a_new_release(self):
+        """
+        Tests that a saved VocabStore reloads unchanged, and that applying the delta to a
+        new release and refreshing its translator gives the table of a store built from
+        the new release, re-translating only the affected source rows.
+        """
+        from cwmed.synthetic import generate_vocabulary, generate_source_file
+
+        concept_path, concept_relationship_path = generate_vocabulary(self.temp_path_to_directory,
+                                                                      concepts=3000)
+        source_path = os.path.join(self.temp_path_to_directory, 'source.csv')
+        generate_source_file(self.temp_path_to_directory, source_path, 'ICD10CM', rows=500,
+                             source_code_col='icd10')
+        with open(source_path, 'a') as f:
+            f.write('Z99.999\n')
+
+        read = dict(sep='\t', dtype=str, keep_default_na=False)
+        concepts = pd.read_csv(concept_path, **read)
+        relationships = pd.read_csv(concept_relationship_path, **read)
+        source_codes = pd.read_csv(source_path, dtype=str)['icd10']
+        used = concepts[concepts['concept_code'].isin(source_codes)]
+        maps_to = relationships[(relationships['relationship_id'] == 'Maps to') &
+                                relationships['concept_id_1'].isin(used['concept_id'])]
+        # Rename a target, invalidate a mapping, remove a source concept and add one.
+        concepts.loc[concepts['concept_id'] == maps_to['concept_id_2'].iloc[0],
+                     'concept_name'] = 'Renamed concept'
+        relationships.loc[maps_to.index[1], ['valid_end_date', 'invalid_reason']] = ['20200101', 'D']
+        concepts = concepts[concepts['concept_id'] != maps_to['concept_id_1'].iloc[2]]
+        target = maps_to['concept_id_2'].iloc[3]
+        concepts = pd.concat([concepts, pd.DataFrame(
+            [['99999999', 'New concept', 'Condition', 'ICD10CM', '7-char billing code', '',
+              'Z99.999', '20240101', '20991231', '']], columns=concepts.columns)])
+        relationships = pd.concat([relationships, pd.DataFrame(
+            [['99999999', target, 'Maps to', '20240101', '20991231', '']],
+            columns=relationships.columns)])
+        new_concept_path = os.path.join(self.temp_path_to_directory, 'NEW_CONCEPT.csv')
+        new_concept_relationship_path = os.path.join(self.temp_path_to_directory,
+                                                     'NEW_CONCEPT_RELATIONSHIP.csv')
+        concepts.to_csv(new_concept_path, sep='\t', index=False)
+        relationships.to_csv(new_concept_relationship_path, sep='\t', index=False)
+
+        for compact in (False, True):
+            with self.subTest(compact=compact):
+                store_path = os.path.join(self.temp_path_to_directory, f'store_{compact}')
+                cw.VocabStore(concept_path, concept_relationship_path, compact=compact,
+                              valid_on=20240101).save(store_path)
+                store = cw.VocabStore.load(store_path)
+                vocab = store.translator('ICD10CM', 'SNOMED', source_filepath=source_path,
+                                         source_code_col='icd10')
+
+                delta = store.diff(new_concept_path, new_concept_relationship_path)
+                self.assertEqual(delta.summary(), {'added_concepts': 1, 'changed_concepts': 1,
+                                                   'removed_concepts': 1, 'added_relationships': 1,
+                                                   'removed_relationships': 1})
+                store.apply_delta(delta)
+                refreshed = vocab.refresh(delta)
+                self.assertGreater(refreshed, 0)
+                self.assertLess(refreshed, len(source_codes))
+
+                fresh = cw.VocabStore(new_concept_path, new_concept_relationship_path,
+                                      compact=compact, valid_on=20240101)
+                expected = fresh.translator('ICD10CM', 'SNOMED', source_filepath=source_path,
+                                            source_code_col='icd10')
+                assert_frame_equal(vocab.target_table, expected.target_table,
+                                   check_categorical=not compact)
+                assert_frame_equal(vocab.translate(['Z99.999']), expected.translate(['Z99.999']))
+
+    def test_fallback_matches_codes_missing_from_the_vocabulary(self):
+        """
+        Tests that with fallback, ICD codes without their dot, in lower case or more
+        specific than any concept translate like the codes they resolve to, with their
+        match type, and that the merges and the index lookups agree.
+        """
+        from cwmed.synthetic import generate_vocabulary, generate_source_file
+
+        concept_path, concept_relationship_path = generate_vocabulary(self.temp_path_to_directory,
+                                                                      concepts=5000)
+        source_path = os.path.join(self.temp_path_to_directory, 'source.csv')
+        generate_source_file(self.temp_path_to_directory, source_path, 'ICD10CM', rows=300,
+                             unknown=0, source_code_col='icd10')
+        codes = pd.read_csv(source_path, dtype=str)['icd10']
+        mangled = codes.copy()
+        mangled[::3] = codes[::3].str.replace('.', '', regex=False).str.lower()
+        mangled[1::3] = codes[1::3] + 'X'
+        mangled_path = os.path.join(self.temp_path_to_directory, 'mangled.csv')
+        mangled.to_frame().to_csv(mangled_path, index=False)
+
+        store = cw.VocabStore(concept_path, concept_relationship_path)
+        expected = store.translator('ICD10CM', 'SNOMED', source_filepath=source_path,
+                                    source_code_col='icd10').target_table
+        plain = store.translator('ICD10CM', 'SNOMED', source_filepath=mangled_path,
+                                 source_code_col='icd10')
+        vocab = store.translator('ICD10CM', 'SNOMED', source_filepath=mangled_path,
+                                 source_code_col='icd10', fallback=True)
+        table = vocab.target_table
+
+        failed = expected['SNOMED_omop_id'].isnull().sum()
+        self.assertGreater(plain.target_table['SNOMED_omop_id'].isnull().sum(), failed)
+        self.assertEqual(table['SNOMED_omop_id'].isnull().sum(), failed)
+        self.assertEqual(list(table.columns), list(expected.columns) + ['ICD10CM_match_type'])
+        match_type_counts = pd.Series(vocab._stage('code_matcher').match(mangled)[1]).value_counts()
+        self.assertEqual(match_type_counts.to_dict(), {'normalized': len(mangled[::3]),
+                                                       'parent': len(mangled[1::3]),
+                                                       'exact': len(mangled[2::3])})
+        match_types = dict(zip(table['ICD10CM'], table['ICD10CM_match_type']))
+        self.assertEqual([match_types[code] for code in mangled[:3]],
+                         ['normalized', 'parent', 'exact'])
+        assert_frame_equal(table.drop(columns=['ICD10CM', 'ICD10CM_match_type']),
+                           expected.drop(columns=['ICD10CM']))
+        assert_frame_equal(vocab.translate(mangled), table)
+
+        # The source concepts are matched with the code matcher, so they are dropped with it.
+        vocab.invalidate('code_matcher')
+        self.assertNotIn('source_concepts', vocab._stages)
+        self.assertNotIn('target_table', vocab._stages)
+        assert_frame_equal(vocab.target_table, table)
+
+    def test_lazy_translator_computes_each_stage_once(self):
+        """
+        Tests that a lazy VocabTranslator reads nothing in its constructor, reads each
+        file once however many stages need it, and recomputes stages after `invalidate`.
+        """
+        with mock.patch('cwmed.read_concept_file', wraps=cw.read_concept_file) as read_concepts, \
+                mock.patch('cwmed.read_concept_relationship_file',
+                           wraps=cw.read_concept_relationship_file) as read_relationships:
+            vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/icd10.csv',
+                            source_code_col = 'icd10',
+                            concept_filepath = 'tests/data/input/icd10_to_snomed_concept.csv',
+                            source_vocab_value = 'ICD10CM',
+                            target_vocab_value = 'SNOMED',
+                            concept_relationship_filepath = 'tests/data/input/icd10_to_snomed_concept_relationship.csv',
+                            lazy = True)
+            self.assertEqual(vocab._stages, {})
+
+            assert_frame_equal(vocab.target_table, self.vocab.target_table)
+            vocab._map_source_concept_id_to_target_concept_id()
+            vocab.save_source_to_target_failed_mappings(self.output_path)
+            self.assertEqual(read_concepts.call_count, 1)
+            self.assertEqual(read_relationships.call_count, 1)
+
+            vocab.invalidate('source_frame')
+            self.assertEqual(sorted(vocab._stages), ['concept_file'])
+            assert_frame_equal(vocab.target_table, self.vocab.target_table)
+            self.assertEqual(read_concepts.call_count, 1)
+            self.assertEqual(read_relationships.call_count, 2)
+
+        with self.assertRaises(ValueError):
+            vocab.invalidate('target')
+
+    def test_recorder_measures_every_stage(self):
+        """
+        Tests that a StageRecorder passes a record of each stage to its hooks and
+        that stats() sums the time and row counts per stage.
+        """
+        records = []
+        recorder = cw.StageRecorder(hooks=[records.append], trace_memory=True)
+        vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/icd10.csv',
+                        source_code_col = 'icd10',
+                        concept_filepath = 'tests/data/input/icd10_to_snomed_concept.csv',
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = 'tests/data/input/icd10_to_snomed_concept_relationship.csv',
+                        recorder = recorder)
+        vocab.save_source_to_target_failed_mappings(self.output_path)
+        vocab.translate(['A04.4'])
+
+        stats = vocab.stats()
+        self.assertEqual(list(stats), ['concept_file', 'source_frame', 'source_concepts',
+                                       'concept_relationships', 'target_table',
+                                       'save_source_to_target_failed_mappings', 'index',
+                                       'translate'])
+        self.assertEqual(len(records), len(stats))
+        source_rows = len(pd.read_csv('tests/data/input/icd10.csv'))
+        self.assertEqual(stats['source_frame']['rows_out'], source_rows)
+        self.assertEqual(stats['target_table']['rows_out'], len(vocab.target_table))
+        self.assertEqual(stats['save_source_to_target_failed_mappings']['rows_out'],
+                         len(pd.read_csv(self.output_path)))
+        self.assertEqual(stats['translate'], {**stats['translate'], 'calls': 1, 'rows_in': 1})
+        for stage in stats.values():
+            self.assertGreaterEqual(stage['seconds'], 0)
+            self.assertGreater(stage['peak_allocated_bytes'], 0)
+        self.assertEqual(self.vocab.stats(), {})
+
+    def test_compact_dtypes_give_same_saved_files(self):
+        """
+        Tests that a VocabTranslator with compact dtypes holds integer concept ids and
+        categorical codes, translates codes with the same dtypes, and still saves the
+        expected source to target files.
+        """
+        vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/icd10.csv',
+                        source_code_col = 'icd10',
+                        concept_filepath = 'tests/data/input/icd10_to_snomed_concept.csv',
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = 'tests/data/input/icd10_to_snomed_concept_relationship.csv',
+                        compact = True)
+        self.assertEqual(vocab.concept_file['concept_id'].dtype, np.int64)
+        self.assertEqual(vocab.concept_file['vocabulary_id'].dtype, 'category')
+        self.assertEqual(vocab.target_table['SNOMED_omop_id'].dtype, 'Int64')
+        assert_frame_equal(vocab.translate(vocab.source_frame['icd10']),
+                           vocab.target_table.reset_index(drop=True))
+
+        vocab.save_source_to_target(self.output_path)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed.csv')
+        vocab.save_source_to_target_failed_mappings(self.output_path)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed_failed_mappings.csv')
+
+    def test_multi_hop_maps_to_reaches_target_vocabulary(self):
+        """
+        Tests that with max_hops, source codes whose "Maps to" relationship lands on an
+        OMOP Extension concept are followed to SNOMED within the hop limit, that a cycle
+        keeps the direct relationship, and that translate gives the same rows.
+        """
+        def snomed_codes(max_hops):
+            vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/multi_hop_icd10.csv',
+                            source_code_col = 'icd10',
+                            concept_filepath = 'tests/data/input/multi_hop_concept.csv',
+                            source_vocab_value = 'ICD10CM',
+                            target_vocab_value = 'SNOMED',
+                            concept_relationship_filepath = 'tests/data/input/multi_hop_concept_relationship.csv',
+                            max_hops = max_hops)
+            assert_frame_equal(vocab.translate(vocab._read_source_file()['icd10']),
+                               vocab.target_table.reset_index(drop=True))
+            table = vocab.target_table.fillna('')
+            return dict(zip(table['ICD10CM'], zip(table['SNOMED'], table['SNOMED_omop_id'])))
+
+        self.assertEqual(snomed_codes(1), {'A04.4': ('111839008', '192815'),
+                                           'C78.7': ('', '900000001'),
+                                           'K00': ('', '900000002'),
+                                           'Z99.9': ('', '900000004'),
+                                           'A04.7': ('', '')})
+        self.assertEqual(snomed_codes(2), {'A04.4': ('111839008', '192815'),
+                                           'C78.7': ('94381002', '198700'),
+                                           'K00': ('', '900000002'),
+                                           'Z99.9': ('', '900000004'),
+                                           'A04.7': ('', '')})
+        self.assertEqual(snomed_codes(3)['Z99.9'], ('105503006', '4000001'))
+        self.assertEqual(snomed_codes(10)['K00'], ('', '900000002'))
+
+    def test_invalidating_the_index_drops_multi_hop_relationships(self):
+        """
+        Tests that with max_hops above one the relationships are computed from the index,
+        so invalidating the index drops them and the target table.
+        """
+        vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/multi_hop_icd10.csv',
+                        source_code_col = 'icd10',
+                        concept_filepath = 'tests/data/input/multi_hop_concept.csv',
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = 'tests/data/input/multi_hop_concept_relationship.csv',
+                        max_hops = 2)
+        target_table = vocab.target_table
+        self.assertIn('index', vocab.stages['concept_relationships'])
+        self.assertIn('index', vocab._stages)
+
+        vocab.invalidate('index')
+        self.assertEqual(sorted(vocab._stages), ['concept_file', 'source_concepts', 'source_frame'])
+        assert_frame_equal(vocab.target_table, target_table)
+        self.assertNotIn('index', self.vocab.stages['concept_relationships'])
+
+    def _copy_vocab_to_temp_directory(self):
+        """
+        Copies the concept and concept relationship test files to the temporary directory,
+        so compiled caches are not written next to the checked-in test data.
+        """
+        concept_path = shutil.copy('tests/data/input/icd10_to_snomed_concept.csv',
+                                   self.temp_path_to_directory)
+        concept_relationship_path = shutil.copy('tests/data/input/icd10_to_snomed_concept_relationship.csv',
+                                                self.temp_path_to_directory)
+        return concept_path, concept_relationship_path
+
+    def test_compiled_vocab_cache_gives_same_source_to_target_table(self):
+        """
+        Tests that a VocabTranslator loading the compiled cache saves the same
+        source to target file as one parsing the tab-separated files.
+        """
+        concept_path, concept_relationship_path = self._copy_vocab_to_temp_directory()
+        cw.compile_vocab(concept_path, concept_relationship_path)
+        self.assertTrue(os.path.isdir(concept_path + '.cwcache'))
+
+        vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/icd10.csv',
+                        source_code_col = 'icd10',
+                        concept_filepath = concept_path,
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = concept_relationship_path)
+        vocab.save_source_to_target(self.output_path)
+        self._compare_csvfiles(self.output_path, 'tests/data/expected/icd10_to_snomed.csv')
+        np.testing.assert_array_equal(cw.get_unique_vocab(concept_path),
+                                      np.array(['ICD10CM', 'SNOMED'], dtype=object))
+
+    def test_compiled_vocab_cache_is_ignored_when_file_changes(self):
+        """
+        Tests that the compiled cache is no longer used once the source file changes size.
+        """
+        concept_path, concept_relationship_path = self._copy_vocab_to_temp_directory()
+        cw.compile_vocab(concept_path, concept_relationship_path)
+        self.assertIsNotNone(cw.cache.load_table(concept_path))
+
+        with open(concept_path, 'a') as f:
+            f.write('1\tExample\tCondition\tLOINC\tLab Test\tS\t1-1\t20070101\t20991231\t\n')
+        self.assertIsNone(cw.cache.load_table(concept_path))
+        self.assertIn('LOINC', cw.get_unique_vocab(concept_path))
+
+    def _serve_vocab_zip(self):
+        """
+        Serves a ZIP of the test vocabulary (plus an unrelated member) from a local
+        HTTP server that honours Range and If-Range requests. Returns the url, the ZIP
+        bytes, the list of Range headers received and the served state, whose 'etag'
+        a test can change to simulate a new release.
+        """
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.write('tests/data/input/icd10_to_snomed_concept.csv', 'CONCEPT.csv')
+            z.write('tests/data/input/icd10_to_snomed_concept_relationship.csv',
+                    'CONCEPT_RELATIONSHIP.csv')
+            z.writestr('README.txt', 'not extracted')
+        body = buffer.getvalue()
+        ranges = []
+        state = {'etag': '"v1"'}
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                ranges.append(self.headers.get('Range'))
+                start = 0
+                if self.headers.get('Range') and self.headers.get('If-Range', state['etag']) == state['etag']:
+                    start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+                else:
+                    self.send_response(200)
+                self.send_header('ETag', state['etag'])
+                self.send_header('Content-Length', str(len(body) - start))
+                self.end_headers()
+                self.wfile.write(body[start:])
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_port}/vocab.zip', body, ranges, state
+
+    def _interrupt_download(self, url, size=100):
+        """
+        Starts a download_data call that fails after writing `size` bytes.
+        """
+        def interrupt(response, filepath, offset, total, chunk_size):
+            with open(filepath, 'wb') as f:
+                f.write(response.raw.read(size))
+            raise requests.ConnectionError('interrupted')
+
+        with mock.patch('cwmed._stream_to_file', side_effect=interrupt), \
+                self.assertRaises(requests.ConnectionError):
+            cw.download_data(url, self.temp_path_to_directory)
+
+    def test_download_data_extracts_only_vocabulary_files(self):
+        """
+        Tests that download_data streams the ZIP file and extracts only CONCEPT.csv
+        and CONCEPT_RELATIONSHIP.csv, optionally compiling their cache.
+        """
+        url, body, ranges, _ = self._serve_vocab_zip()
+        recorder = cw.StageRecorder()
+        cw.download_data(url, self.temp_path_to_directory, chunk_size=64, compile_cache=True,
+                         recorder=recorder)
+
+        self.assertEqual(ranges, [None])
+        stats = recorder.stats()
+        self.assertEqual(list(stats), ['download', 'extract', 'compile_cache'])
+        self.assertEqual(stats['download']['bytes'], len(body))
+        self.assertEqual(sorted(os.listdir(self.temp_path_to_directory)),
+                         ['CONCEPT.csv', 'CONCEPT.csv.cwcache',
+                          'CONCEPT_RELATIONSHIP.csv', 'CONCEPT_RELATIONSHIP.csv.cwcache'])
+        self.assertTrue(filecmp.cmp(os.path.join(self.temp_path_to_directory, 'CONCEPT.csv'),
+                                    'tests/data/input/icd10_to_snomed_concept.csv', shallow=False))
+
+    def test_download_data_resumes_partial_download(self):
+        """
+        Tests that download_data requests only the missing bytes of a partial download.
+        """
+        url, body, ranges, _ = self._serve_vocab_zip()
+        self._interrupt_download(url)
+        cw.download_data(url, self.temp_path_to_directory, keep_zip=True)
+
+        self.assertEqual(ranges, [None, 'bytes=100-'])
+        with open(os.path.join(self.temp_path_to_directory, 'athena_vocabulary.zip'), 'rb') as f:
+            self.assertEqual(f.read(), body)
+        self.assertTrue(filecmp.cmp(
+            os.path.join(self.temp_path_to_directory, 'CONCEPT_RELATIONSHIP.csv'),
+            'tests/data/input/icd10_to_snomed_concept_relationship.csv', shallow=False))
+        self.assertNotIn(cw.DOWNLOAD_FILENAME + '.json', os.listdir(self.temp_path_to_directory))
+
+    def test_download_data_restarts_partial_download_of_another_file(self):
+        """
+        Tests that download_data starts over instead of resuming a partial file without
+        a record of its url, of another url, or of a file that changed on the server.
+        """
+        url, body, ranges, state = self._serve_vocab_zip()
+        part_path = os.path.join(self.temp_path_to_directory, cw.DOWNLOAD_FILENAME)
+        zip_path = os.path.join(self.temp_path_to_directory, 'athena_vocabulary.zip')
+
+        def download():
+            # Bytes of another file, which would corrupt the ZIP if resumed.
+            with open(part_path, 'wb') as f:
+                f.write(b'x' * 100)
+            cw.download_data(url, self.temp_path_to_directory, keep_zip=True)
+            with open(zip_path, 'rb') as f:
+                self.assertEqual(f.read(), body)
+
+        download()
+        self.assertEqual(ranges, [None])
+
+        self._interrupt_download(url.replace('vocab.zip', 'other.zip'))
+        download()
+        self.assertEqual(ranges[1:], [None, None])
+
+        self._interrupt_download(url)
+        state['etag'] = '"v2"'
+        download()
+        self.assertEqual(ranges[3:], [None, 'bytes=100-'])
+
     def test_get_unique_vocab_returns_expected_output_as_np_ndarray(self):
         """
         Tests the get_unique_vocab function from the
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from pandas.testing import assert_frame_equal
+
+import cwmed as cw
+
+
+class TestVocabIndex(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Builds a VocabIndex from the ICD10CM to SNOMED test vocabulary and saves it to a
+        temporary directory, from which it is opened again with memory-mapped arrays.
+        """
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.temp_directory.name, 'index')
+        index = cw.VocabIndex.build('tests/data/input/icd10_to_snomed_concept.csv',
+                                    'tests/data/input/icd10_to_snomed_concept_relationship.csv')
+        index.save(self.index_path)
+        self.index = cw.VocabIndex.open(self.index_path)
+
+    def tearDown(self):
+        """
+        Deletes the temporary directory created during test setup.
+        """
+        self.temp_directory.cleanup()
+
+    def test_lookup_maps_source_code_to_target_code(self):
+        """
+        Tests that icd10 code 'A04.4' is looked up as snomed code '111839008', and that
+        an unknown code returns a single row without a target.
+        """
+        result = self.index.lookup('A04.4', 'ICD10CM', 'SNOMED')
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['SNOMED'], '111839008')
+        self.assertEqual(result[0]['SNOMED_omop_id'], '192815')
+        self.assertEqual(result[0]['ICD10CM_omop_id'], '35205417')
+
+        result = self.index.lookup('A04.7', 'ICD10CM', 'SNOMED')
+        self.assertEqual(len(result), 1)
+        self.assertTrue(np.isnan(result[0]['SNOMED_omop_id']))
+
+    def test_lookup_many_matches_source_to_target_table(self):
+        """
+        Tests that looking up every code of the source file gives the same table
+        as the VocabTranslator merges.
+        """
+        vocab = cw.VocabTranslator(source_filepath = 'tests/data/input/icd10.csv',
+                        source_code_col = 'icd10',
+                        concept_filepath = 'tests/data/input/icd10_to_snomed_concept.csv',
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = 'tests/data/input/icd10_to_snomed_concept_relationship.csv')
+        codes = vocab._read_source_file()['icd10']
+        result = self.index.lookup_many(codes, 'ICD10CM', 'SNOMED')
+        assert_frame_equal(result, vocab.target_table.reset_index(drop=True))
+
+
+if __name__=='__main__':
+    unittest.main()
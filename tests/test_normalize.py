@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+import cwmed as cw
+
+
+class TestCodeMatcher(unittest.TestCase):
+
+    def test_normalize_codes_strips_punctuation_and_pads_ndc(self):
+        """
+        Tests that codes are upper cased without punctuation, that NDC codes are put in
+        the 11-digit 5-4-2 format and that missing codes stay missing.
+        """
+        self.assertEqual(cw.normalize_codes([' a04.4 ', 'A04.4', 'C78-7'], 'ICD10CM').tolist(),
+                         ['A044', 'A044', 'C787'])
+        ndc = cw.normalize_codes(['0002-3227-01', '50090-347-01', '12345-6789-1', '7323001',
+                                  '00007323001', np.nan], 'NDC')
+        self.assertEqual(ndc[:5].tolist(), ['00002322701', '50090034701', '12345678901',
+                                            '00007323001', '00007323001'])
+        self.assertTrue(np.isnan(ndc[5]))
+
+    def test_match_falls_back_to_normalized_and_nearest_parent_code(self):
+        """
+        Tests that each code is flagged with the match it used, that a code falls back
+        to its nearest parent, and that unmatched codes keep their value.
+        """
+        matcher = cw.CodeMatcher(['A04', 'A04.7', 'A04.4', 'C78.7'], 'ICD10CM')
+        codes, match_types = matcher.match(['A04.4', 'a044', 'A04.72', 'A04.9', 'A0472',
+                                            'Z99.1', 'A04.4', np.nan])
+        self.assertEqual(codes[:7].tolist(),
+                         ['A04.4', 'A04.4', 'A04.7', 'A04', 'A04.7', 'Z99.1', 'A04.4'])
+        self.assertTrue(np.isnan(codes[7]))
+        self.assertEqual(match_types.tolist(),
+                         ['exact', 'normalized', 'parent', 'parent', 'parent', 'unmatched',
+                          'exact', 'unmatched'])
+
+        # Codes of vocabularies without a hierarchy do not fall back to a prefix.
+        matcher = cw.CodeMatcher(['00007323001'], 'NDC')
+        self.assertEqual(matcher.match(['0007-3230-01', '000073230011'])[1].tolist(),
+                         ['normalized', 'unmatched'])
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import concurrent.futures
+import unittest
+
+import pandas as pd
+import requests
+from pandas.testing import assert_frame_equal
+
+import cwmed as cw
+from cwmed.server import VocabClient, VocabServer
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.store = cw.VocabStore('tests/data/input/icd10_to_snomed_concept.csv',
+                                   'tests/data/input/icd10_to_snomed_concept_relationship.csv')
+        self.server = VocabServer(self.store, port=0, max_batch_wait=0.2).start()
+        self.client = VocabClient(self.server.url)
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_concurrent_requests_are_coalesced_into_batches(self):
+        """
+        Tests that concurrent requests get the same table as a direct lookup and
+        share lookups, and that stats() reports their latency.
+        """
+        codes = pd.read_csv('tests/data/input/icd10.csv', dtype=str)['icd10'].tolist()
+        requests = [codes[i::8] + ['A04.4'] for i in range(8)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(
+                lambda request: self.client.translate(request, 'ICD10CM', 'SNOMED'), requests))
+
+        index = self.store.index()
+        for request, result in zip(requests, results):
+            expected = index.lookup_many(request, 'ICD10CM', 'SNOMED')
+            assert_frame_equal(result.fillna(''), expected.astype(object).fillna(''))
+
+        stats = self.client.stats()
+        self.assertEqual(stats['requests'], 8)
+        self.assertLess(stats['batches'], 8)
+        self.assertGreater(stats['requests_per_batch'], 1)
+        self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+    def test_invalid_request_is_rejected(self):
+        """
+        Tests that a request translating a vocabulary to itself gets an error.
+        """
+        with self.assertRaises(ValueError):
+            self.client.translate(['A04.4'], 'ICD10CM', 'ICD10CM')
+        self.assertEqual(self.client.stats()['errors'], 1)
+
+    def test_malformed_request_does_not_stop_later_requests(self):
+        """
+        Tests that requests with a vocabulary, codes or max_hops of the wrong type get a
+        400 error, that a failing batch sets the error of its requests, and that the
+        batch thread keeps serving valid requests after them.
+        """
+        valid = {'codes': ['A04.4'], 'source_vocab_value': 'ICD10CM', 'target_vocab_value': 'SNOMED'}
+        for malformed in ({'source_vocab_value': ['ICD10CM']}, {'codes': 'A04.4'},
+                          {'max_hops': '2'}):
+            response = requests.post(f'{self.server.url}/translate', json={**valid, **malformed},
+                                     timeout=10)
+            self.assertEqual(response.status_code, 400)
+
+        future = concurrent.futures.Future()
+        self.server._lookup([((['ICD10CM'], 'SNOMED', 1), ['A04.4'], future)], 1)
+        with self.assertRaises(TypeError):
+            future.result(timeout=0)
+
+        result = self.client.translate(['A04.4'], 'ICD10CM', 'SNOMED')
+        self.assertEqual(result['SNOMED'].tolist(), ['111839008'])
+        self.assertTrue(all(thread.is_alive() for thread in self.server._threads))
+
+
+if __name__=='__main__':
+    unittest.main()
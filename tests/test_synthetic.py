@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import cwmed as cw
+from cwmed.synthetic import generate_source_file, generate_vocabulary
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.directory = self.temp_directory.name
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_generated_vocabulary_is_reproducible_and_translates(self):
+        """
+        Tests that the same seed writes the same files, with unique codes per vocabulary,
+        and that a VocabTranslator maps most generated source codes.
+        """
+        concept_path, concept_relationship_path = generate_vocabulary(self.directory, concepts=5000)
+        other_directory = os.path.join(self.directory, 'again')
+        generate_vocabulary(other_directory, concepts=5000)
+        for filename in ('CONCEPT.csv', 'CONCEPT_RELATIONSHIP.csv'):
+            with open(os.path.join(self.directory, filename)) as f, \
+                    open(os.path.join(other_directory, filename)) as g:
+                self.assertEqual(f.read(), g.read())
+
+        concepts = pd.read_csv(concept_path, sep='\t', dtype=str)
+        self.assertFalse(concepts.duplicated(['vocabulary_id', 'concept_code']).any())
+        self.assertFalse(concepts['concept_id'].duplicated().any())
+
+        source_path = os.path.join(self.directory, 'icd10cm.csv')
+        source_code_col = generate_source_file(self.directory, source_path, 'ICD10CM', rows=2000)
+        vocab = cw.VocabTranslator(source_filepath = source_path,
+                        source_code_col = source_code_col,
+                        concept_filepath = concept_path,
+                        source_vocab_value = 'ICD10CM',
+                        target_vocab_value = 'SNOMED',
+                        concept_relationship_filepath = concept_relationship_path)
+        mapped = vocab.target_table['SNOMED_omop_id'].notnull().mean()
+        self.assertGreater(mapped, 0.8)
+        self.assertLess(mapped, 1.0)
+
+
+if __name__=='__main__':
+    unittest.main()